@@ -0,0 +1,148 @@
+"""
+Offline OCR throughput and accuracy benchmark.
+
+Reads a corpus of synthetic receipts (see :mod:`mott.synth`) through the same
+worker pool and pipeline the bot uses, once per pipeline configuration, and
+reports images per second, p50/p95 latency, peak RSS, exact-match
+accuracy and how often the fast OCR tier was enough. For example::
+
+    python bench.py --count 100 --workers 4 --engine tesserocr
+"""
+
+import argparse
+import json
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mott.engine import DEFAULT_ENGINE, available_engine, get_engine, init_engine
+from mott.exceptions import MottException
+from mott.ocr import OCRConfig, read_tiered
+from mott.synth import generate
+
+CONFIGS = {
+    "default": OCRConfig(),
+    "single-pass": OCRConfig(tiered=False),
+    "full-frame": OCRConfig(roi=False),
+    "binarise": OCRConfig(binarise=True),
+    "max-width-960": OCRConfig(max_width=960),
+}
+
+
+def peak_rss():
+    """Peak resident set size in MiB of this process and its reaped children."""
+    self_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kib = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_kib, children_kib) / 1024
+
+
+def timed_read(image_bytes, config):
+    """Read one image in a worker, returning the value or error, its tier,
+    the time taken, the RSS and the engine the worker loaded."""
+    start = time.perf_counter()
+    tier = None
+    try:
+        amount, tier = read_tiered(image_bytes, config)
+        value = amount.value
+    except MottException as e:
+        value = type(e).__name__
+    return value, tier, time.perf_counter() - start, peak_rss(), get_engine().name
+
+
+def summarise(name, values, expected, tiers, latencies, rss, engines, elapsed):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "config": name,
+        # what the workers loaded, which falls back to the default engine
+        # when the one asked for cannot be started
+        "engine": ",".join(sorted(set(engines))),
+        "images": len(values),
+        "images_per_sec": len(values) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "peak_rss_mib": rss,
+        "accuracy": sum(v == e for v, e in zip(values, expected)) / len(values),
+        "fast_tier": tiers.count("fast") / len(values),
+    }
+
+
+def run(name, config, receipts, workers, engine):
+    # a fresh pool per configuration keeps the peak RSS figures separate
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_engine, initargs=(engine,)
+    ) as pool:
+        # warm the workers up so start-up is not counted as throughput
+        list(pool.map(init_engine, [engine] * workers))
+        start = time.perf_counter()
+        futures = [
+            pool.submit(timed_read, receipt.image_bytes, config) for receipt in receipts
+        ]
+        results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+    values, tiers, latencies, rss, engines = zip(*results)
+    expected = [receipt.value for receipt in receipts]
+    for receipt, value in zip(receipts, values):
+        if value != receipt.value:
+            print(
+                f"  {name}: read {value} instead of {receipt.value}"
+                f" ({receipt.size[0]}x{receipt.size[1]}, {receipt.font},"
+                f" quality {receipt.quality})"
+            )
+    return summarise(
+        name, values, expected, tiers, latencies, max(rss), engines, elapsed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=50, help="receipts to read")
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="OCR processes"
+    )
+    parser.add_argument("--engine", default=DEFAULT_ENGINE, help="tesseract backend")
+    parser.add_argument(
+        "--config",
+        action="append",
+        choices=sorted(CONFIGS),
+        help="pipeline configuration to run, may be repeated (default: all)",
+    )
+    parser.add_argument("--save", help="also write the corpus to this directory")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    receipts = list(generate(args.count, args.seed))
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for i, receipt in enumerate(receipts):
+            with open(f"{args.save}/{i:04d}_{receipt.value}.jpeg", "wb") as f:
+                f.write(receipt.image_bytes)
+
+    engine = available_engine(args.engine)
+    results = [
+        run(name, CONFIGS[name], receipts, args.workers, engine)
+        for name in args.config or CONFIGS
+    ]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    engines = ",".join(sorted({r["engine"] for r in results}))
+    print(
+        f"{args.count} receipts, seed {args.seed}, {args.workers} {engines} workers"
+        f" ({engine} requested)\n"
+        f"{'config':<16}{'img/s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'RSS MiB':>9}{'accuracy':>10}{'fast tier':>11}"
+    )
+    for r in results:
+        print(
+            f"{r['config']:<16}{r['images_per_sec']:>8.2f}{r['p50_ms']:>9.0f}"
+            f"{r['p95_ms']:>9.0f}{r['peak_rss_mib']:>9.0f}{r['accuracy']:>10.1%}"
+            f"{r['fast_tier']:>11.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
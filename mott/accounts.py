@@ -1,23 +1,150 @@
+import asyncio
 import time
 import functools
 import os
+import sqlite3
 from datetime import datetime
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import tinydb
+from tinydb.table import Document
 from mott.exceptions import MottException
+from mott.ledger import Ledger
+from mott.storage import CachingJSONStorage, WALTinyDB
 
 logger_discord = logging.getLogger("discord")
 
 
-@functools.cache
-def get_bank(bank_id):
-    database_dir = os.getenv("DISCORD_BOT_DB_DIR")
-    db_file_path = f"{database_dir}/{str(bank_id).replace(' ', '_')}_db.json"
+def open_bank(db_file_stem):
+    backend = os.getenv("DISCORD_BOT_DB_BACKEND", "wal")
+    if backend == "sqlite":
+        return SQLiteAccounts(f"{db_file_stem}.sqlite")
+    db_file_path = f"{db_file_stem}.json"
     logger_discord.info(
         f"get handler for db: {db_file_path} already exists? {os.path.isfile(db_file_path)}"
     )
-    db = tinydb.TinyDB(db_file_path)
-    return Accounts(db)
+    if backend == "json":
+        return Accounts(tinydb.TinyDB(db_file_path, storage=CachingJSONStorage))
+    if backend == "wal":
+        db = WALTinyDB(
+            db_file_path,
+            sync_every=int(os.getenv("DISCORD_BOT_DB_SYNC_EVERY", 32)),
+            compact_every=int(os.getenv("DISCORD_BOT_DB_COMPACT_EVERY", 10000)),
+        )
+        return Accounts(db)
+    raise MottException(f"unknown database backend: {backend}")
+
+
+def bank_file_stem(bank_id):
+    database_dir = os.getenv("DISCORD_BOT_DB_DIR")
+    return f"{database_dir}/{str(bank_id).replace(' ', '_')}_db"
+
+
+class BankManager:
+    """The :class:`AsyncAccounts` of every guild, with at most capacity of
+    their banks open at once.
+
+    A guild keeps the same facade for the life of the process, so there is
+    only ever one writer per ledger, but its bank is closed when it is the
+    least recently used one over capacity or has not been used for
+    idle_timeout seconds, and reopened by the next call. Banks with calls in
+    progress or payments waiting to be committed are never closed.
+    """
+
+    def __init__(self, open_bank, capacity=256, idle_timeout=600.0, **bank_options):
+        self._open_bank = open_bank
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.bank_options = bank_options
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._banks = {}
+        # guilds with an open bank, least recently used first
+        self._open = OrderedDict()
+
+    def __len__(self):
+        return len(self._open)
+
+    def get(self, bank_id):
+        bank = self._banks.get(bank_id)
+        if bank is None:
+            bank = AsyncAccounts(
+                functools.partial(self._open_bank, bank_id),
+                bank_id,
+                **self.bank_options,
+            )
+            self._banks[bank_id] = bank
+        if bank_id in self._open:
+            self.hits += 1
+            self._open.move_to_end(bank_id)
+        else:
+            self.misses += 1
+        self._open[bank_id] = time.monotonic()
+        self.evict()
+        return bank
+
+    def evict(self):
+        """Close the banks over capacity or idle for too long."""
+        now = time.monotonic()
+        # never the bank that was just asked for
+        for bank_id, last_used in list(self._open.items())[:-1]:
+            over = len(self._open) > self.capacity
+            if not over and now - last_used < self.idle_timeout:
+                break
+            bank = self._banks[bank_id]
+            if bank.in_use:
+                continue
+            del self._open[bank_id]
+            bank.evict()
+            self.evictions += 1
+            logger_discord.info(
+                f"closed bank {bank_id}: {len(self._open)} open,"
+                f" {self.hits} hits, {self.misses} misses,"
+                f" {self.evictions} evictions"
+            )
+
+    def close(self):
+        for bank in self._banks.values():
+            bank.close()
+        self._banks.clear()
+        self._open.clear()
+
+
+_bank_manager = None
+
+
+def get_bank_manager():
+    """Return the bank manager, creating it on first use.
+
+    ``DISCORD_BOT_DB_OPEN_BANKS`` sets how many guild banks may be open at
+    once (default: 256) and ``DISCORD_BOT_DB_IDLE_TIMEOUT`` after how many
+    seconds without use a bank is closed (default: 600).
+    """
+    global _bank_manager
+    if _bank_manager is None:
+        _bank_manager = BankManager(
+            lambda bank_id: open_bank(bank_file_stem(bank_id)),
+            capacity=int(os.getenv("DISCORD_BOT_DB_OPEN_BANKS", 256)),
+            idle_timeout=float(os.getenv("DISCORD_BOT_DB_IDLE_TIMEOUT", 600)),
+            batch_window=float(os.getenv("DISCORD_BOT_DB_BATCH_WINDOW", 0.02)),
+            batch_size=int(os.getenv("DISCORD_BOT_DB_BATCH_SIZE", 64)),
+        )
+    return _bank_manager
+
+
+def get_bank(bank_id):
+    """Return the :class:`AsyncAccounts` of a guild."""
+    return get_bank_manager().get(bank_id)
+
+
+def close_banks():
+    """Close every open bank, compacting their logs."""
+    global _bank_manager
+    if _bank_manager is not None:
+        _bank_manager.close()
+        _bank_manager = None
 
 
 class AccountError(MottException):
@@ -60,91 +187,311 @@ class AccountAlreadyExistsError(AccountError):
         super().__init__(self.message)
 
 
+class AccountAmountError(AccountError):
+    def __init__(self, account_name, value, message=""):
+        if message == "":
+            self.message = (
+                f"Account: {account_name} cannot take an amount of {value} aUEC,"
+                f" the most is {MAX_AMOUNT}."
+            )
+        else:
+            self.message = message
+        self.account_name = account_name
+        super().__init__(self.message)
+
+
+# far beyond any real transfer, so the sums of an account stay well inside the
+# 64-bit integers sqlite and the ledger arrays hold
+MAX_AMOUNT = 10**12
+
+
+def check_amount(account_name, value):
+    if abs(value) > MAX_AMOUNT:
+        raise AccountAmountError(account_name, value)
+
+
+def new_transaction(message_id, user_id, value, verified):
+    d = datetime.now()
+    unixtime = int(time.mktime(d.timetuple()))
+    return {
+        "message_id": message_id,
+        "timestamp": unixtime,
+        "user_id": user_id,
+        "value": value,
+        "ocr-verified": verified,
+    }
+
+
+def plan_payments(payments, exists, has_message):
+    """Sort a batch of :meth:`Accounts.pay_to` arguments into the transactions
+    to insert into each account.
+
+    Returns the result of each payment, True, False for a duplicate or an
+    error, and the transactions by account. A payment to deduplicate is a
+    duplicate if its message was recorded before or earlier in the batch.
+    """
+    results = []
+    inserts = {}
+    for message_id, sender_name, account_name, value, verified, deduplicate in payments:
+        if not exists(account_name):
+            results.append(AccountDoesNotExistError(account_name))
+            continue
+        if abs(value) > MAX_AMOUNT:
+            results.append(AccountAmountError(account_name, value))
+            continue
+        transactions = inserts.setdefault(account_name, [])
+        if deduplicate and (
+            any(t["message_id"] == message_id for t in transactions)
+            or has_message(account_name, message_id)
+        ):
+            logger_discord.info(
+                f"account {account_name}: message {message_id} already recorded"
+            )
+            results.append(False)
+            continue
+        transactions.append(new_transaction(message_id, sender_name, value, verified))
+        results.append(True)
+    return results, inserts
+
+
+ZERO_TOTALS = {"count": 0, "balance": 0, "withdrawls": 0, "contributions": []}
+
+
+def tally(totals, transactions, sign=1):
+    """Add (sign 1) or take away (sign -1) transactions from account totals.
+
+    Contributions are kept as ``[user_id, total, count]`` lists rather than a
+    dict so user ids keep their type when stored as JSON, and a contributor
+    is dropped once none of their transactions are left.
+    """
+    contributions = {
+        user_id: [total, count] for user_id, total, count in totals["contributions"]
+    }
+    for transaction in transactions:
+        value = transaction["value"]
+        totals["count"] += sign
+        totals["balance"] += sign * value
+        if value < 0:
+            totals["withdrawls"] += sign * abs(value)
+        else:
+            contribution = contributions.setdefault(transaction["user_id"], [0, 0])
+            contribution[0] += sign * value
+            contribution[1] += sign
+            if contribution[1] == 0:
+                del contributions[transaction["user_id"]]
+    totals["contributions"] = [
+        [user_id, total, count] for user_id, (total, count) in contributions.items()
+    ]
+    return totals
+
+
+def refreshed(method):
+    """Bring the indexes of :class:`Accounts` up to date before method."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._refresh()
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class Accounts:
     def __init__(self, db):
         self.db = db
         self.accounts_table = self.db.table("accounts")
+        # owning role of each account, for existence and permission checks
+        # without scanning the accounts table
+        self._owners = {doc["account"]: doc["owners"] for doc in self.accounts_table}
+        # balance, withdrawls and contributions of each account, kept up to
+        # date on every write so they need not be summed from the ledger
+        self.totals_table = self.db.table("totals")
+        self._checked_totals = set()
+        # doc ids of each account's transactions by message id
+        self._messages = {}
+        # the version of the database the indexes were built from, for
+        # storages that notice the file being changed by something else
+        self._generation = getattr(self.db.storage, "generation", None)
+
+    def _refresh(self):
+        """Drop the indexes if the database was changed by something else."""
+        if not hasattr(self.db.storage, "refresh"):
+            return
+        generation = self.db.storage.refresh()
+        if generation == self._generation:
+            return
+        logger_discord.info("database changed on disk, rebuilding indexes")
+        self._generation = generation
+        self._owners = {doc["account"]: doc["owners"] for doc in self.accounts_table}
+        self._checked_totals.clear()
+        self._messages.clear()
+        # TinyDB tables remember the next doc id to insert with as well
+        for name in self.db.tables():
+            self.db.table(name)._next_id = None
+
+    def close(self):
+        self.db.close()
 
+    @refreshed
     def create(self, account_name, role_id):
         query = tinydb.Query()
-        if self.accounts_table.contains(query.account == account_name):
+        if account_name in self._owners:
             raise AccountAlreadyExistsError(account_name)
-        self.accounts_table.insert(
-            {"account": account_name, "owners": str(role_id).replace("@", "")}
-        )
+        owners = str(role_id).replace("@", "")
+        self.accounts_table.insert({"account": account_name, "owners": owners})
+        self._owners[account_name] = owners
         table = self.db.table(f"{account_name}_transactions")
+        self.totals_table.upsert(
+            {"account": account_name, **ZERO_TOTALS}, query.account == account_name
+        )
+        self._checked_totals.add(account_name)
 
+    @refreshed
     def delete(self, account_name):
         query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
         self.db.drop_table(f"{account_name}_transactions")
+        self._messages.pop(account_name, None)
+        self.totals_table.remove(query.account == account_name)
         self.accounts_table.remove(tinydb.Query()["account"] == account_name)
+        del self._owners[account_name]
 
+    @refreshed
     def owning_role(self, account_name):
-        query = tinydb.Query()
-        account_info = self.accounts_table.get(query.account == account_name)
-        if account_info["account"] == account_name:
-            return account_info["owners"]
+        if account_name in self._owners:
+            return self._owners[account_name]
         raise MottException(f"owning role for account: {account_name} not found")
-        return None
 
+    @refreshed
     def reset(self, account_name):
-        query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
         role = self.owning_role(account_name)
         self.delete(account_name)
         self.create(account_name, role)
 
-    def balance(self, account_name) -> float:
+    @refreshed
+    def rebuild_totals(self, account_name):
+        """Recompute the totals of an account from its ledger."""
         query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
-            raise AccountDoesNotExistError(account_name)
-        total = 0
-        logger_discord.info(f"balance known accounts: {self.db.tables()}")
-        transactions_db = self.db.table(f"{account_name}_transactions")
-        for doc in transactions_db:
-            total += doc["value"]
-        return total
+        totals = {"account": account_name, **self._ledger(account_name).totals()}
+        self.totals_table.upsert(totals, query.account == account_name)
+        self._checked_totals.add(account_name)
+        return self.totals_table.get(query.account == account_name)
 
-    def pay_to(self, message_id, sender_name, account_name, value, verified=False):
+    @refreshed
+    def totals(self, account_name):
+        """Return the totals document of an account.
+
+        Totals are written after the ledger, so the first time an account is
+        used they are checked against the number of transactions and rebuilt
+        if a crash came between the two writes, or if they do not exist yet.
+        """
         query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        totals = self.totals_table.get(query.account == account_name)
+        if totals is None or (
+            account_name not in self._checked_totals
+            and totals["count"] != len(self.db.table(f"{account_name}_transactions"))
+        ):
+            logger_discord.info(f"rebuilding totals of account: {account_name}")
+            return self.rebuild_totals(account_name)
+        self._checked_totals.add(account_name)
+        return totals
+
+    def _update_totals(self, totals, transactions, sign=1):
+        tally(totals, transactions, sign)
+        self.totals_table.update(
+            {k: totals[k] for k in ZERO_TOTALS}, doc_ids=[totals.doc_id]
+        )
+
+    @refreshed
+    def balance(self, account_name) -> float:
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
-        d = datetime.now()
-        unixtime = int(time.mktime(d.timetuple()))
+        return self.totals(account_name)["balance"]
+
+    def _insert(self, account_name, transactions):
+        totals = self.totals(account_name)
+        messages = self._message_index(account_name)
         transactions_db = self.db.table(f"{account_name}_transactions")
-        transactions_db.insert(
-            {
-                "message_id": message_id,
-                "timestamp": unixtime,
-                "user_id": sender_name,
-                "value": value,
-                "ocr-verified": verified,
-            }
+        doc_ids = transactions_db.insert_multiple(transactions)
+        for transaction, doc_id in zip(transactions, doc_ids):
+            messages.setdefault(transaction["message_id"], []).append(doc_id)
+        self._update_totals(totals, transactions)
+
+    def _message_index(self, account_name):
+        """Doc ids of an account's transactions by message id, built from the
+        ledger the first time the account is used."""
+        if account_name not in self._messages:
+            messages = {}
+            for doc in self.db.table(f"{account_name}_transactions"):
+                messages.setdefault(doc["message_id"], []).append(doc.doc_id)
+            self._messages[account_name] = messages
+        return self._messages[account_name]
+
+    def _ledger(self, account_name):
+        """The transactions of an account as a :class:`~mott.ledger.Ledger`."""
+        transactions_db = self.db.table(f"{account_name}_transactions")
+        return Ledger.from_documents(transactions_db)
+
+    @refreshed
+    def has_message(self, account_name, message_id):
+        """Whether any transactions of an account were recorded from a message."""
+        if account_name not in self._owners:
+            raise AccountDoesNotExistError(account_name)
+        return message_id in self._message_index(account_name)
+
+    def pay_to(
+        self,
+        message_id,
+        sender_name,
+        account_name,
+        value,
+        verified=False,
+        deduplicate=False,
+    ):
+        """Record a payment, returning False if deduplicate is set and the
+        message has already been recorded."""
+        (result,) = self.pay_many(
+            [(message_id, sender_name, account_name, value, verified, deduplicate)]
         )
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @refreshed
+    def pay_many(self, payments):
+        """Record a batch of payments with one write per account.
 
+        payments are tuples of the :meth:`pay_to` arguments. The result of
+        each is returned in order, with errors returned instead of raised.
+        """
+        results, inserts = plan_payments(
+            payments, lambda name: name in self._owners, self.has_message
+        )
+        for account_name, transactions in inserts.items():
+            if transactions:
+                self._insert(account_name, transactions)
+        return results
+
+    def sync(self):
+        """Make the writes so far durable, if the storage defers it."""
+        if hasattr(self.db.storage, "sync"):
+            self.db.storage.sync()
+
+    @refreshed
     def withdraw_from(self, message_id, payee_name, account_name, value):
-        query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
-        d = datetime.now()
-        unixtime = int(time.mktime(d.timetuple()))
-        transactions_db = self.db.table(f"{account_name}_transactions")
-        transactions_db.insert(
-            {
-                "message_id": message_id,
-                "timestamp": unixtime,
-                "user_id": payee_name,
-                "value": -value,
-                "ocr-verified": False,
-            }
+        check_amount(account_name, value)
+        self._insert(
+            account_name, [new_transaction(message_id, payee_name, -value, False)]
         )
 
+    @refreshed
     def last_transaction(self, account_name):
-        query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
         transactions_db = self.db.table(f"{account_name}_transactions")
         if len(transactions_db) < 1:
@@ -152,63 +499,572 @@ class Accounts:
         el = transactions_db.all()[-1]
         return transactions_db.get(doc_id=el.doc_id)
 
+    @refreshed
     def remove_transactions(self, account_name, message_id):
-        query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
-        db = self.db.table(f"{account_name}_transactions")
-        transactions = db.search(query.message_id == message_id)
-        if len(transactions) == 0:
+        totals = self.totals(account_name)
+        messages = self._message_index(account_name)
+        if message_id not in messages:
             raise AccountError(
                 account_name,
                 message=f"Account: {account_name} has no transactions matching that message",
             )
-        doc_ids = [d.doc_id for d in transactions]
+        db = self.db.table(f"{account_name}_transactions")
+        doc_ids = messages[message_id]
+        transactions = [db.get(doc_id=doc_id) for doc_id in doc_ids]
         db.remove(doc_ids=doc_ids)
+        del messages[message_id]
+        self._update_totals(totals, transactions, sign=-1)
         return transactions
 
+    @refreshed
     def summary(self, account_name):
-        query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
-        source_contributions = {}
-        withdrawls = 0
-        transactions_db = self.db.table(f"{account_name}_transactions")
-        transaction_query = tinydb.Query()
-        for line in transactions_db:
-            if line["value"] < 0:
-                withdrawls += abs(line["value"])
-            else:
-                if source_contributions.get(line["user_id"]):
-                    source_contributions[line["user_id"]] += line["value"]
-                else:
-                    source_contributions[line["user_id"]] = line["value"]
-        return source_contributions, withdrawls
+        totals = self.totals(account_name)
+        source_contributions = {
+            user_id: total for user_id, total, _ in totals["contributions"]
+        }
+        return source_contributions, totals["withdrawls"]
 
+    @refreshed
     def all(self, account_name):
-        query = tinydb.Query()
-        if not self.accounts_table.contains(query.account == account_name):
+        if account_name not in self._owners:
             raise AccountDoesNotExistError(account_name)
-        transactions_db = self.db.table(f"{account_name}_transactions")
-        if len(transactions_db) < 1:
+        ledger = self._ledger(account_name)
+        if len(ledger) < 1:
             raise AccountEmptyError(account_name)
-        return transactions_db.all()
+        return ledger
 
+    @refreshed
     def permitted(self, account_name, role_ids):
         role_ids_san = [str(r).replace("@", "") for r in role_ids]
         logger_discord.info(
             f"permissions check: {role_ids_san} sufficient for {account_name}?"
         )
-        for account_info in self.accounts_table:
-            logger_discord.info(
-                f"permissions check: {account_info['account']} {account_info['owners']}"
+        return self._owners.get(account_name) in role_ids_san
+
+    @refreshed
+    def account_names(self):
+        return list(self._owners)
+
+
+class SQLiteAccounts:
+    """:class:`Accounts` kept in an sqlite database instead of TinyDB.
+
+    Transactions of every account share one table, indexed so balances,
+    summaries and lookups by message only visit the rows they need. Columns
+    are declared without a type so account names and ids keep the type they
+    were given, as they do in TinyDB, and transactions are returned as TinyDB
+    documents with the row id as the doc_id. Account totals are kept in
+    their own tables, updated in the same database transaction as the ledger.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS accounts (account PRIMARY KEY, owners)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS transactions"
+                " (id INTEGER PRIMARY KEY AUTOINCREMENT, account NOT NULL,"
+                " message_id, timestamp INTEGER, user_id, value, verified INTEGER)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS transactions_account_time"
+                " ON transactions (account, timestamp)"
             )
-            if (
-                account_info["account"] == account_name
-                and account_info["owners"] in role_ids_san
-            ):
-                return True
-        return False
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS transactions_message"
+                " ON transactions (message_id)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS transactions_user"
+                " ON transactions (user_id)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS totals"
+                " (account PRIMARY KEY, balance, withdrawls)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS contributions"
+                " (account, user_id, total, count, PRIMARY KEY (account, user_id))"
+            )
+        missing = self.db.execute(
+            "SELECT account FROM accounts"
+            " WHERE account NOT IN (SELECT account FROM totals)"
+        ).fetchall()
+        for (account_name,) in missing:
+            logger_discord.info(f"rebuilding totals of account: {account_name}")
+            self.rebuild_totals(account_name)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def _document(row):
+        doc_id, message_id, timestamp, user_id, value, verified = row
+        return Document(
+            {
+                "message_id": message_id,
+                "timestamp": timestamp,
+                "user_id": user_id,
+                "value": value,
+                "ocr-verified": bool(verified),
+            },
+            doc_id=doc_id,
+        )
+
+    def _transactions(self, where, args, order="ASC", limit=-1):
+        rows = self.db.execute(
+            "SELECT id, message_id, timestamp, user_id, value, verified"
+            f" FROM transactions WHERE {where}"
+            f" ORDER BY timestamp {order}, id {order} LIMIT ?",
+            (*args, limit),
+        )
+        return [self._document(row) for row in rows]
+
+    def _tally(self, account_name, transactions, sign=1):
+        for transaction in transactions:
+            value = transaction["value"]
+            withdrawl = abs(value) if value < 0 else 0
+            self.db.execute(
+                "UPDATE totals SET balance = balance + ?,"
+                " withdrawls = withdrawls + ? WHERE account = ?",
+                (sign * value, sign * withdrawl, account_name),
+            )
+            if value >= 0:
+                self.db.execute(
+                    "INSERT INTO contributions VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (account, user_id) DO UPDATE"
+                    " SET total = total + excluded.total, count = count + excluded.count",
+                    (account_name, transaction["user_id"], sign * value, sign),
+                )
+        self.db.execute(
+            "DELETE FROM contributions WHERE account = ? AND count = 0",
+            (account_name,),
+        )
+
+    def rebuild_totals(self, account_name):
+        """Recompute the totals of an account from its ledger."""
+        with self.db:
+            self.db.execute("DELETE FROM totals WHERE account = ?", (account_name,))
+            self.db.execute(
+                "DELETE FROM contributions WHERE account = ?", (account_name,)
+            )
+            self.db.execute(
+                "INSERT INTO totals SELECT ?, COALESCE(SUM(value), 0),"
+                " COALESCE(SUM(CASE WHEN value < 0 THEN -value END), 0)"
+                " FROM transactions WHERE account = ?",
+                (account_name, account_name),
+            )
+            self.db.execute(
+                "INSERT INTO contributions SELECT account, user_id, SUM(value),"
+                " COUNT(*) FROM transactions WHERE account = ? AND value >= 0"
+                " GROUP BY user_id ORDER BY MIN(id)",
+                (account_name,),
+            )
+
+    def _check_exists(self, account_name):
+        if not self.exists(account_name):
+            raise AccountDoesNotExistError(account_name)
+
+    def exists(self, account_name):
+        row = self.db.execute(
+            "SELECT 1 FROM accounts WHERE account = ?", (account_name,)
+        ).fetchone()
+        return row is not None
+
+    def create(self, account_name, role_id):
+        if self.exists(account_name):
+            raise AccountAlreadyExistsError(account_name)
+        with self.db:
+            self.db.execute(
+                "INSERT INTO accounts (account, owners) VALUES (?, ?)",
+                (account_name, str(role_id).replace("@", "")),
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO totals VALUES (?, 0, 0)", (account_name,)
+            )
+
+    def delete(self, account_name):
+        self._check_exists(account_name)
+        with self.db:
+            self.db.execute(
+                "DELETE FROM transactions WHERE account = ?", (account_name,)
+            )
+            self.db.execute("DELETE FROM accounts WHERE account = ?", (account_name,))
+            self.db.execute("DELETE FROM totals WHERE account = ?", (account_name,))
+            self.db.execute(
+                "DELETE FROM contributions WHERE account = ?", (account_name,)
+            )
+
+    def owning_role(self, account_name):
+        row = self.db.execute(
+            "SELECT owners FROM accounts WHERE account = ?", (account_name,)
+        ).fetchone()
+        if row is None:
+            raise MottException(f"owning role for account: {account_name} not found")
+        return row[0]
+
+    def reset(self, account_name):
+        self._check_exists(account_name)
+        with self.db:
+            self.db.execute(
+                "DELETE FROM transactions WHERE account = ?", (account_name,)
+            )
+            self.db.execute(
+                "UPDATE totals SET balance = 0, withdrawls = 0 WHERE account = ?",
+                (account_name,),
+            )
+            self.db.execute(
+                "DELETE FROM contributions WHERE account = ?", (account_name,)
+            )
+
+    def balance(self, account_name) -> float:
+        row = self.db.execute(
+            "SELECT balance FROM totals WHERE account = ?", (account_name,)
+        ).fetchone()
+        if row is None:
+            raise AccountDoesNotExistError(account_name)
+        return row[0]
+
+    def _insert(self, account_name, transactions):
+        self.db.executemany(
+            "INSERT INTO transactions"
+            " (account, message_id, timestamp, user_id, value, verified)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    account_name,
+                    t["message_id"],
+                    t["timestamp"],
+                    t["user_id"],
+                    t["value"],
+                    t["ocr-verified"],
+                )
+                for t in transactions
+            ],
+        )
+        self._tally(account_name, transactions)
+
+    def has_message(self, account_name, message_id):
+        """Whether any transactions of an account were recorded from a message."""
+        self._check_exists(account_name)
+        row = self.db.execute(
+            "SELECT 1 FROM transactions WHERE message_id = ? AND account = ?",
+            (message_id, account_name),
+        ).fetchone()
+        return row is not None
+
+    def pay_to(
+        self,
+        message_id,
+        sender_name,
+        account_name,
+        value,
+        verified=False,
+        deduplicate=False,
+    ):
+        """Record a payment, returning False if deduplicate is set and the
+        message has already been recorded."""
+        (result,) = self.pay_many(
+            [(message_id, sender_name, account_name, value, verified, deduplicate)]
+        )
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def pay_many(self, payments):
+        """Record a batch of payments in one database transaction.
+
+        payments are tuples of the :meth:`pay_to` arguments. The result of
+        each is returned in order, with errors returned instead of raised.
+        """
+        results, inserts = plan_payments(payments, self.exists, self.has_message)
+        with self.db:
+            for account_name, transactions in inserts.items():
+                if transactions:
+                    self._insert(account_name, transactions)
+        return results
+
+    def sync(self):
+        """Commits are already durable."""
+
+    def withdraw_from(self, message_id, payee_name, account_name, value):
+        self._check_exists(account_name)
+        check_amount(account_name, value)
+        with self.db:
+            self._insert(
+                account_name, [new_transaction(message_id, payee_name, -value, False)]
+            )
+
+    def last_transaction(self, account_name):
+        self._check_exists(account_name)
+        transactions = self._transactions(
+            "account = ?", (account_name,), order="DESC", limit=1
+        )
+        if len(transactions) < 1:
+            raise AccountEmptyError(account_name)
+        return transactions[0]
+
+    def remove_transactions(self, account_name, message_id):
+        self._check_exists(account_name)
+        transactions = self._transactions(
+            "message_id = ? AND account = ?", (message_id, account_name)
+        )
+        if len(transactions) == 0:
+            raise AccountError(
+                account_name,
+                message=f"Account: {account_name} has no transactions matching that message",
+            )
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM transactions WHERE id = ?",
+                [(t.doc_id,) for t in transactions],
+            )
+            self._tally(account_name, transactions, sign=-1)
+        return transactions
+
+    def summary(self, account_name):
+        row = self.db.execute(
+            "SELECT withdrawls FROM totals WHERE account = ?", (account_name,)
+        ).fetchone()
+        if row is None:
+            raise AccountDoesNotExistError(account_name)
+        source_contributions = dict(
+            self.db.execute(
+                "SELECT user_id, total FROM contributions"
+                " WHERE account = ? ORDER BY rowid",
+                (account_name,),
+            )
+        )
+        return source_contributions, row[0]
+
+    def all(self, account_name):
+        self._check_exists(account_name)
+        ledger = Ledger.from_rows(
+            self.db.execute(
+                "SELECT id, message_id, timestamp, user_id, value, verified"
+                " FROM transactions WHERE account = ? ORDER BY timestamp, id",
+                (account_name,),
+            )
+        )
+        if len(ledger) < 1:
+            raise AccountEmptyError(account_name)
+        return ledger
+
+    def permitted(self, account_name, role_ids):
+        role_ids_san = [str(r).replace("@", "") for r in role_ids]
+        logger_discord.info(
+            f"permissions check: {role_ids_san} sufficient for {account_name}?"
+        )
+        try:
+            return self.owning_role(account_name) in role_ids_san
+        except MottException:
+            return False
 
     def account_names(self):
-        return [doc["account"] for doc in self.accounts_table]
+        return [row[0] for row in self.db.execute("SELECT account FROM accounts")]
+
+
+class AsyncAccounts:
+    """Awaitable access to a bank from the event loop.
+
+    Every method of the bank is run on a storage thread of its own, so disk
+    I/O never blocks the gateway, and calls are made one at a time in the
+    order they were awaited, so writes to a guild's ledger are serialised.
+    The bank is opened by the first call, on the storage thread, so it is
+    only ever used from that thread.
+
+    Payments are committed in groups: ``pay_to`` calls made within
+    batch_window seconds of each other, up to batch_size of them, are
+    written with one :meth:`Accounts.pay_many` and synced to disk once
+    before any of them returns. Any other call first commits the payments
+    waiting before it, so it sees them. Storage that defers syncing to disk
+    is synced sync_interval seconds after a call, so the last writes to a
+    bank that has gone quiet do not wait for the next one to be durable.
+
+    :meth:`evict` closes the bank and stops its thread without waiting, and
+    the next call starts a new thread that reopens the bank once the old one
+    has been closed.
+    """
+
+    def __init__(
+        self, open_bank, name="", batch_window=0.0, batch_size=64, sync_interval=1.0
+    ):
+        self._open_bank = open_bank
+        self._bank = None
+        self.name = name
+        self._executor = None
+        # the close of the bank by the thread before the current one
+        self._closing = None
+        # calls and commits sent to the storage thread and not yet finished
+        self._in_flight = 0
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.commits = 0
+        # (pay_to arguments, future) waiting to be committed
+        self._pending = []
+        self._commit_handle = None
+        self.sync_interval = sync_interval
+        self._sync_handle = None
+
+    @property
+    def in_use(self):
+        return self._in_flight > 0 or len(self._pending) > 0
+
+    def _storage_thread(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"bank-{self.name}"
+            )
+            if self._closing is not None:
+                # reopen only once the previous thread has closed the bank
+                self._executor.submit(self._closing.result)
+                self._closing = None
+        return self._executor
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        try:
+            return await loop.run_in_executor(self._storage_thread(), function, *args)
+        finally:
+            self._in_flight -= 1
+            if self._sync_handle is None and self.sync_interval > 0:
+                self._sync_handle = loop.call_later(self.sync_interval, self._sync_idle)
+
+    def _sync_idle(self):
+        self._sync_handle = None
+        if self._executor is not None:
+            # queued behind the calls already made, a closed bank needs none
+            self._executor.submit(self._sync)
+
+    def _sync(self):
+        if self._bank is None:
+            return
+        try:
+            self._bank.sync()
+        except Exception as e:
+            logger_discord.error(f"bank {self.name}: sync failed: {e}")
+
+    def _call(self, method, args, kwargs):
+        if self._bank is None:
+            self._bank = self._open_bank()
+        return getattr(self._bank, method)(*args, **kwargs)
+
+    def _commit(self, payments):
+        results = self._call("pay_many", (payments,), {})
+        self._bank.sync()
+        return results
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            self._commit_pending()
+            return await self._run(self._call, method, args, kwargs)
+
+        call.__name__ = method
+        return call
+
+    @staticmethod
+    def _payment(
+        message_id,
+        sender_name,
+        account_name,
+        value,
+        verified=False,
+        deduplicate=False,
+    ):
+        return message_id, sender_name, account_name, value, verified, deduplicate
+
+    async def pay_to(self, *args, **kwargs):
+        payment = self._payment(*args, **kwargs)
+        if self.batch_window <= 0:
+            return await self._run(self._call, "pay_to", payment, {})
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payment, future))
+        if len(self._pending) >= self.batch_size:
+            self._commit_pending()
+        elif self._commit_handle is None:
+            self._commit_handle = loop.call_later(
+                self.batch_window, self._commit_pending
+            )
+        return await future
+
+    def _commit_pending(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self.commits += 1
+        # submitted straight away, so it is ahead of any call made after it
+        self._in_flight += 1
+        commit = asyncio.get_running_loop().run_in_executor(
+            self._storage_thread(),
+            self._commit,
+            [payment for payment, _ in pending],
+        )
+
+        def acknowledge(commit):
+            self._in_flight -= 1
+            futures = [future for _, future in pending]
+            if commit.cancelled():
+                for future in futures:
+                    future.cancel()
+                return
+            if commit.exception() is not None:
+                results = [commit.exception()] * len(futures)
+            else:
+                results = commit.result()
+            for future, result in zip(futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        commit.add_done_callback(acknowledge)
+
+    def _close(self):
+        if self._bank is not None:
+            self._bank.close()
+            self._bank = None
+
+    def evict(self):
+        """Close the bank after the calls already made, without waiting."""
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        self._closing = executor.submit(self._close)
+        executor.shutdown(wait=False)
+
+    def close(self):
+        """Close the bank once the calls already made have finished."""
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            # the loop has stopped, nobody is waiting on these any more
+            self._storage_thread().submit(
+                self._commit, [p for p, _ in pending]
+            ).result()
+        if self._executor is not None:
+            self._executor.submit(self._close).result()
+            self._executor.shutdown()
+            self._executor = None
+        elif self._closing is not None:
+            self._closing.result()
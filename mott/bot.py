@@ -8,6 +8,7 @@ Once you create an account in a channel I will begin watching all images posted
 """
 
 import os
+import functools
 import logging
 import logging.handlers
 from pathlib import Path
@@ -18,11 +19,23 @@ import asyncio
 
 from mott.exceptions import MottException
 import mott.accounts as accounts
-from mott.ocr import OCR, uri_validator
+from mott.classify import NotAReceiptError
+from mott.ocr import (
+    OCR,
+    OCRConfig,
+    OCRaUECNotFoundError,
+    OCRNumberNotFoundError,
+    uri_validator,
+    close_ocr_cache,
+    shutdown_ocr_pool,
+)
+from mott.download import DownloadError, open_session, close_session, scaled_url
+from mott.scheduler import get_ocr_scheduler, close_ocr_scheduler
 
 module_doc = __doc__
 
 APP_COMMAND = "!motrader "
+QUEUED_EMOJI = "⏳"
 
 discord.utils.setup_logging(level=logging.INFO, root=False)
 
@@ -50,7 +63,7 @@ async def has_admin_role(ctx):
     guild = ctx.message.guild
     guild_bank = accounts.get_bank(guild.id)
     user_role_ids = [r.id for r in ctx.message.author.roles]
-    return guild_bank.permitted(ctx.message.channel.id, user_role_ids)
+    return await guild_bank.permitted(ctx.message.channel.id, user_role_ids)
 
 
 @commands.command()
@@ -64,7 +77,9 @@ async def pay(ctx, auec_value: int):
     sender_name = message.author.display_name
     account_name = message.channel.name
 
-    guild_bank.pay_to(message.id, message.author.id, message.channel.id, auec_value)
+    await guild_bank.pay_to(
+        message.id, message.author.id, message.channel.id, auec_value
+    )
 
     info_message = (
         f"{guild} {sender_name}: responding to `pay` request,"
@@ -114,7 +129,7 @@ async def withdraw(ctx, auec_value: int):
     sender_name = message.author.display_name
     account_name = message.channel.name
 
-    guild_bank.withdraw_from(
+    await guild_bank.withdraw_from(
         message.id, message.author.id, message.channel.id, auec_value
     )
 
@@ -156,7 +171,7 @@ async def last_transaction(ctx):
     sender_name = message.author.display_name
     account_name = message.channel.name
 
-    transaction = guild_bank.last_transaction(message.channel.id)
+    transaction = await guild_bank.last_transaction(message.channel.id)
 
     info_message = f"{guild} {sender_name}: responding to `last` request"
     logger_discord.info(info_message)
@@ -203,7 +218,7 @@ async def create(
     sender_name = message.author.display_name
     account_name = account_channel.name
 
-    guild_bank.create(account_channel.id, owning_role.id)
+    await guild_bank.create(account_channel.id, owning_role.id)
     response = f"account: {account_name} created for {owning_role.name}"
 
     info_message = (
@@ -254,7 +269,7 @@ async def _all(
     sender_name = message.author.display_name
     account_name = account_channel.name
 
-    all_transactions = guild_bank.all(account_channel.id)
+    all_transactions = await guild_bank.all(account_channel.id)
     response = f"### Account Transactions: {account_name}\n"
     response += f"time,author,value,ocr-verified\n"
     for transaction in all_transactions:
@@ -309,7 +324,7 @@ async def delete(
     sender_name = message.author.display_name
     account_name = account_channel.name
 
-    guild_bank.delete(account_channel.id)
+    await guild_bank.delete(account_channel.id)
     response = f"account: {account_name} deleted"
 
     info_message = (
@@ -358,7 +373,7 @@ async def reset(
     sender_name = message.author.display_name
     account_name = account_channel.name
 
-    guild_bank.reset(account_channel.id)
+    await guild_bank.reset(account_channel.id)
     response = f"account: {account_name} reset"
 
     info_message = (
@@ -399,7 +414,7 @@ async def balance(
 
     sender_name = str(message.author.display_name)
     account_name = account_channel.name
-    balance = guild_bank.balance(account_channel.id)
+    balance = await guild_bank.balance(account_channel.id)
     response = f"{account_name} balance: {balance}aUEC"
 
     info_message = (
@@ -441,7 +456,7 @@ async def summary(
 
     sender_name = str(message.author.display_name)
     account_name = account_channel.name
-    source_contributions, withdrawls = guild_bank.summary(account_channel.id)
+    source_contributions, withdrawls = await guild_bank.summary(account_channel.id)
 
     response = f"### Account Summary: {account_name}\n"
     for contributor_id, value in source_contributions.items():
@@ -449,7 +464,7 @@ async def summary(
         contributor = user.display_name
         response += f'"{contributor}" paid: {int(value):d}aUEC\n'
     response += f"withdrawn: {int(withdrawls):d}aUEC\n"
-    balance = guild_bank.balance(account_channel.id)
+    balance = await guild_bank.balance(account_channel.id)
     response += f"balance: {int(balance):d}aUEC\n"
 
     info_message = (
@@ -486,45 +501,191 @@ async def on_message(message):
     is_private = False
 
     if len(message.attachments) > 0:
+        try:
+            recorded = await guild_bank.has_message(message.channel.id, message.id)
+        except accounts.AccountDoesNotExistError:
+            recorded = False
+        if recorded:
+            # a replayed gateway event for a receipt that was already paid
+            logger_discord.info(
+                f" {guild}#{channel} {username}: message {message.id} already recorded"
+            )
+            return
         logger_discord.info(
             f" {guild}#{channel} {username}: Reading images from {channel}"
         )
+        scheduler = get_ocr_scheduler()
+        images = []
         for attachment in message.attachments:
             try:
                 if attachment_is_image(attachment):
+                    images.append(attachment)
+            except commands.CommandError as e:
+                images.append(e)
+        if len(scheduler) + len(images) > scheduler.capacity:
+            # let the user know we will get to it
+            queued = True
+            try:
+                await message.add_reaction(QUEUED_EMOJI)
+            except discord.NotFound:
+                # deleted already, the scheduler will not read its images
+                queued = False
+        else:
+            queued = False
+
+        async def read(attachment):
+            if isinstance(attachment, Exception):
+                raise attachment
+            logger_discord.info(
+                f" {guild}#{channel} {username}: Reading image at {attachment.url}"
+            )
+            return await scheduler.run(
+                guild.id,
+                message.channel.id,
+                functools.partial(read_attachment, attachment),
+                tag=message.id,
+            )
+
+        # the confidence below which the OCR pipeline double checked a read
+        min_confidence = OCRConfig.from_env().min_confidence
+        results = []
+        duplicate = False
+        deleted = False
+        try:
+            # the images are read concurrently but recorded in attachment order
+            amounts = await asyncio.gather(
+                *(read(attachment) for attachment in images), return_exceptions=True
+            )
+            if any(isinstance(amount, asyncio.CancelledError) for amount in amounts):
+                logger_discord.info(
+                    f" {guild}#{channel} {username}: message deleted while reading it"
+                )
+                deleted = True
+                return
+            for attachment, amount in zip(images, amounts):
+                if scheduler.cancelled(message.id):
+                    # deleted after its images were read, while earlier ones
+                    # were being recorded
                     logger_discord.info(
-                        f" {guild}#{channel} {username}: Reading image at {attachment.url}"
+                        f" {guild}#{channel} {username}:"
+                        " message deleted while recording it"
                     )
-                    ocr_reader = await OCR.create(attachment.proxy_url)
-                    auec_amount = await ocr_reader.image_to_auec()
-                    guild_bank.pay_to(
+                    deleted = True
+                    break
+                try:
+                    if isinstance(amount, BaseException):
+                        raise amount
+                    # low confidence reads are recorded but not marked verified
+                    verified = amount.confidence >= min_confidence
+                    # only the first image is checked against a replay of the
+                    # same message read at the same time, the rest belong
+                    # with it
+                    recorded = await guild_bank.pay_to(
                         message.id,
                         user_id,
                         message.channel.id,
-                        auec_amount,
-                        verified=True,
+                        amount.value,
+                        verified=verified,
+                        deduplicate=not any(results),
                     )
-                    response = (
-                        f"{username} paid {message.channel.name} {auec_amount} aUEC."
-                        f" If I got this wrong react to your image with :x:"
+                    if not recorded:
+                        duplicate = True
+                        break
+                    results.append((amount.value, verified))
+                except NotAReceiptError:
+                    # memes and other screenshots are not worth a reply
+                    logger_discord.info(
+                        f" {guild}#{channel} {username}:"
+                        f" {attachment.url} is not a receipt"
                     )
-                    await message.channel.send(response)
-            except commands.CommandError as e:
-                if isinstance(e, commands.CommandInvokeError):
-                    e = e.original
-                logger_discord.error("Exception during image text recognition")
-                logger_discord.error(e.message)
-                response_message = (
-                    f"Sorry, I couldn't read the aUEC from that screenshot."
-                    f" Please check the examples above and try a different "
-                    f"screenshot. Make sure you use a screenshot and not a "
-                    f"photograph of the screen (I can't read images of PC monitors sorry)."
-                    f" Alternatively, enter the payment manually with `{APP_COMMAND} pay`."
+                except commands.CommandError as e:
+                    if isinstance(e, commands.CommandInvokeError):
+                        e = e.original
+                    logger_discord.error("Exception during image text recognition")
+                    logger_discord.error(e.message)
+                    results.append(None)
+                except Exception:
+                    # e.g. a worker process that died, the other images of
+                    # the message are still recorded and replied to
+                    logger_discord.exception(
+                        "Unexpected exception during image text recognition"
+                    )
+                    results.append(None)
+        finally:
+            # the images recorded so far are replied to whatever happens
+            if duplicate:
+                logger_discord.info(
+                    f" {guild}#{channel} {username}:"
+                    f" message {message.id} already recorded"
+                )
+            elif results and not deleted:
+                await message.channel.send(
+                    receipt_response(username, message.channel.name, results)
                 )
-                await message.channel.send(response_message)
+            if queued and not deleted:
+                try:
+                    await message.remove_reaction(QUEUED_EMOJI, guild.me)
+                except discord.NotFound:
+                    pass
         return
 
 
+def receipt_response(username, account_name, results):
+    """One reply for the images of a message.
+
+    results holds a (value, verified) pair for each image that was recorded,
+    or None for each image that could not be read, in attachment order.
+    """
+    advice = (
+        "Please check the examples above and try a different "
+        "screenshot. Make sure you use a screenshot and not a "
+        "photograph of the screen (I can't read images of PC monitors sorry)."
+        f" Alternatively, enter the payment manually with `{APP_COMMAND} pay`."
+    )
+    hint = "If I got this wrong react to your image with :x:"
+
+    lines = []
+    for i, result in enumerate(results, start=1):
+        if result is None:
+            image = "that screenshot" if len(results) == 1 else f"image {i}"
+            lines.append(f"Sorry, I couldn't read the aUEC from {image}.")
+            continue
+        value, verified = result
+        line = f"{username} paid {account_name} {value} aUEC."
+        if not verified:
+            line += " I'm not sure I read that right, please check it."
+        lines.append(line)
+    if len(results) == 1:
+        return f"{lines[0]} {advice if results[0] is None else hint}"
+    if None in results:
+        lines.append(advice)
+    if any(results):
+        lines.append(hint)
+    return "\n".join(lines)
+
+
+async def read_attachment(attachment):
+    """Read a downscaled copy of the attachment, then the original if needed."""
+    url = scaled_url(attachment.proxy_url, attachment.width, attachment.height)
+    if url is not None:
+        try:
+            ocr_reader = await OCR.create(url)
+            return await ocr_reader.image_to_amount()
+        except (OCRaUECNotFoundError, OCRNumberNotFoundError, DownloadError) as e:
+            logger_discord.info(f" reading the original image after: {e.message}")
+    ocr_reader = await OCR.create(attachment.proxy_url)
+    return await ocr_reader.image_to_amount()
+
+
+async def on_raw_message_delete(payload):
+    """Stop reading the images of a deleted message."""
+    cancelled = get_ocr_scheduler().cancel(payload.message_id)
+    if cancelled:
+        logger_discord.info(
+            f" cancelled {cancelled} OCR jobs of deleted message {payload.message_id}"
+        )
+
+
 async def on_reaction_add(reaction, user):
     """Cancel an mo.trader transaction associated with an account."""
     if user.id != reaction.message.author.id:
@@ -545,7 +706,7 @@ async def on_reaction_add(reaction, user):
         # remove all transactions with that message id (multiple image
         # attachments can be contained in a single image) throw error if not
         # found
-        transactions = guild_bank.remove_transactions(
+        transactions = await guild_bank.remove_transactions(
             reaction.message.channel.id, message_id
         )
         response = "I am removing any transactions associated with your reaction:\n"
@@ -583,13 +744,23 @@ def attachment_is_image(attachment):
     return False
 
 
+class MottBot(commands.Bot):
+    async def setup_hook(self):
+        await open_session()
+
+    async def close(self):
+        await close_ocr_scheduler()
+        await close_session()
+        await super().close()
+
+
 def run_discord_bot():
     TOKEN = os.getenv("DISCORD_BOT_SECRET_TOKEN")
 
     intents = discord.Intents.default()
     intents.message_content = True
 
-    discordbot = commands.Bot(
+    discordbot = MottBot(
         command_prefix=APP_COMMAND, intents=intents, description=module_doc
     )
 
@@ -598,6 +769,7 @@ def run_discord_bot():
     discordbot.add_command(last_transaction)
     discordbot.add_listener(on_message)
     discordbot.add_listener(on_reaction_add)
+    discordbot.add_listener(on_raw_message_delete)
 
     discordbot.add_command(_account)
     _account.add_command(create)
@@ -607,4 +779,9 @@ def run_discord_bot():
     _account.add_command(summary)
     _account.add_command(_all)
 
-    discordbot.run(TOKEN, log_handler=None)
+    try:
+        discordbot.run(TOKEN, log_handler=None)
+    finally:
+        shutdown_ocr_pool()
+        close_ocr_cache()
+        accounts.close_banks()
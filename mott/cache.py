@@ -0,0 +1,176 @@
+"""
+Content-addressed cache of OCR results.
+
+Images are keyed by a hash of their bytes, and of a version naming the
+settings and engine that read them, so a reposted, cross-posted or replayed
+screenshot costs a lookup instead of an OCR pass while a change to how images
+are read starts afresh. Recent results are
+held in a bounded in-memory LRU, optionally backed by an sqlite file that
+survives restarts. The bot uses :meth:`OCRCache.fetch` and
+:meth:`OCRCache.store`, which make the sqlite queries and commits on a thread
+of the cache's own rather than on the event loop.
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from mott.extract import Amount
+
+logger_discord = logging.getLogger("discord")
+
+
+class CachedFailure:
+    """An OCR parse failure stored in place of a value."""
+
+    def __init__(self, error, message):
+        self.error = error
+        self.message = message
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, CachedFailure)
+            and self.error == other.error
+            and self.message == other.message
+        )
+
+    def __repr__(self):
+        return f"CachedFailure({self.error!r}, {self.message!r})"
+
+
+class OCRCache:
+    def __init__(self, capacity=1024, path=None, disk_capacity=100000):
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._db = None
+        self._executor = None
+        if path is not None:
+            # used from the cache's thread, one call at a time
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache "
+                "(key TEXT PRIMARY KEY, value INTEGER, confidence REAL,"
+                " error TEXT, message TEXT, used REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS ocr_cache_used ON ocr_cache (used)"
+            )
+            self._db.commit()
+            (self._disk_entries,) = self._db.execute(
+                "SELECT COUNT(*) FROM ocr_cache"
+            ).fetchone()
+            logger_discord.info(
+                f"OCR cache: {self._disk_entries} results persisted in {path}"
+            )
+
+    @staticmethod
+    def key(image_bytes, version=""):
+        digest = hashlib.sha256(version.encode())
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached Amount or :class:`CachedFailure`, None on a miss."""
+        if key in self._entries:
+            return self._found(key, self._entries[key])
+        entry = self._load(key) if self._db is not None else None
+        return self._found(key, entry)
+
+    async def fetch(self, key):
+        """As :meth:`get`, reading the disk tier on the cache's thread."""
+        if key in self._entries or self._db is None:
+            return self.get(key)
+        return self._found(key, await self._in_thread(self._load, key))
+
+    def put(self, key, entry):
+        self._remember(key, entry)
+        if self._db is not None:
+            self._save(key, entry)
+
+    async def store(self, key, entry):
+        """As :meth:`put`, writing the disk tier on the cache's thread."""
+        self._remember(key, entry)
+        if self._db is not None:
+            await self._in_thread(self._save, key, entry)
+
+    def _in_thread(self, function, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="ocr-cache"
+            )
+        return asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    def _found(self, key, entry):
+        if entry is None:
+            self.misses += 1
+            return None
+        self._remember(key, entry)
+        self.hits += 1
+        return entry
+
+    def _load(self, key):
+        row = self._db.execute(
+            "SELECT value, confidence, error, message FROM ocr_cache WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        # so that eviction drops the least recently used results
+        self._db.execute(
+            "UPDATE ocr_cache SET used = ? WHERE key = ?", (time.time(), key)
+        )
+        self._db.commit()
+        value, confidence, error, message = row
+        if error is None:
+            return Amount(value, confidence)
+        return CachedFailure(error, message)
+
+    def _save(self, key, entry):
+        if isinstance(entry, CachedFailure):
+            row = (key, None, None, entry.error, entry.message, time.time())
+        else:
+            row = (key, entry.value, entry.confidence, None, None, time.time())
+        self._db.execute(
+            "INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?, ?, ?)", row
+        )
+        # an upper bound, replaced keys are only recounted on eviction
+        self._disk_entries += 1
+        if self._disk_entries > self.disk_capacity:
+            # evict the least recently used tenth in one statement
+            self._db.execute(
+                "DELETE FROM ocr_cache WHERE key IN "
+                "(SELECT key FROM ocr_cache ORDER BY used LIMIT ?)",
+                (max(1, self.disk_capacity // 10),),
+            )
+            (self._disk_entries,) = self._db.execute(
+                "SELECT COUNT(*) FROM ocr_cache"
+            ).fetchone()
+        self._db.commit()
+
+    def _remember(self, key, entry):
+        if self.capacity <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
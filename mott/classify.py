@@ -0,0 +1,119 @@
+"""
+Cheap test of whether an image looks like a mo.trader receipt at all.
+
+Watched channels also get memes, ship screenshots and selfies, and each of
+those would otherwise cost a full tesseract pass before failing to find any
+aUEC. A receipt is a landscape screenshot of a dark scene with a grey,
+unsaturated panel in the middle, which can be checked on a thumbnail decoded
+at a fraction of the full resolution in a few milliseconds. Screenshots
+cropped down to the panel, which users often post, are recognised by being
+mostly panel coloured with text and edges in them.
+"""
+
+import io
+import logging
+
+import numpy as np
+from PIL import Image
+
+from mott.exceptions import MottException
+
+logger_discord = logging.getLogger("discord")
+
+THUMBNAIL_HEIGHT = 36
+# landscape screens from 4:3 to 32:9
+ASPECT_RATIOS = (1.2, 3.6)
+# the transfer panel of the reference screenshot, the panel scales with the
+# screen height and is roughly centred horizontally
+PANEL_CENTRE = 0.476
+PANEL_HALF_WIDTH = 0.21
+PANEL_ROWS = (0.2, 0.77)
+# how far the panel may be from where the template expects it, in thumbnail
+# pixels
+SHIFTS = (6, 3)
+# a crop of the panel is at least this much panel, and the spread of its grey
+# levels, from text and edges, is between the two values for it to start to
+# and fully count, which leaves out flat and noisy images
+CROP_PANEL = 0.6
+CROP_CONTRAST = (10, 60)
+
+
+class NotAReceiptError(MottException):
+    def __init__(self, score, message=""):
+        if message == "":
+            self.message = f"OCR: image does not look like a mo.trader receipt"
+        else:
+            self.message = message
+        logger_discord.debug(f"Receipt classifier score: {score}")
+        super().__init__(self.message)
+
+
+def thumbnail(image_bytes):
+    """Decode a small RGB copy of an image, using JPEG draft mode if possible."""
+    image = Image.open(io.BytesIO(image_bytes))
+    height = THUMBNAIL_HEIGHT
+    width = max(1, round(height * image.width / image.height))
+    image.draft("RGB", (width * 2, height * 2))
+    return np.asarray(image.convert("RGB").resize((width, height)), dtype=np.int16)
+
+
+def panel_match(panel):
+    """Best intersection over union of a panel mask and the panel template.
+
+    The template box is slid over the thumbnail by up to :data:`SHIFTS`
+    pixels, using a summed area table so every position costs four lookups.
+    """
+    height, width = panel.shape
+    area = np.zeros((height + 1, width + 1))
+    area[1:, 1:] = panel.cumsum(axis=0).cumsum(axis=1)
+    total = area[-1, -1]
+    half = PANEL_HALF_WIDTH * height
+    left = round(PANEL_CENTRE * width - half)
+    right = round(PANEL_CENTRE * width + half)
+    top, bottom = (round(r * height) for r in PANEL_ROWS)
+    best = 0.0
+    for dx in range(-SHIFTS[0], SHIFTS[0] + 1):
+        x0, x1 = max(0, left + dx), min(width, right + dx)
+        for dy in range(-SHIFTS[1], SHIFTS[1] + 1):
+            y0, y1 = max(0, top + dy), min(height, bottom + dy)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            inside = area[y1, x1] - area[y0, x1] - area[y1, x0] + area[y0, x0]
+            box = (x1 - x0) * (y1 - y0)
+            best = max(best, inside / (box + total - inside))
+    return best
+
+
+def crop_score(panel, gray):
+    """Score from 0 to 1 how much an image looks cropped to the panel."""
+    low, high = np.percentile(gray, [2, 98])
+    contrast = (high - low - CROP_CONTRAST[0]) / (CROP_CONTRAST[1] - CROP_CONTRAST[0])
+    return min(1.0, panel.mean() / CROP_PANEL) * float(np.clip(contrast, 0.0, 1.0))
+
+
+def receipt_score(image_bytes):
+    """Score from 0 to 1 how much an encoded image looks like a receipt.
+
+    A full screenshot is scored by how well the grey, unsaturated pixels
+    match the transfer panel, scaled down when the rest of the screen is not
+    mostly dark, and only if it is landscape. An image of any shape may
+    instead score as a crop of the panel, see :func:`crop_score`.
+    """
+    pixels = thumbnail(image_bytes)
+    height, width = pixels.shape[:2]
+    gray = pixels.mean(axis=2)
+    saturation = pixels.max(axis=2) - pixels.min(axis=2)
+    panel = (gray > 70) & (gray < 200) & (saturation < 40)
+    score = crop_score(panel, gray)
+    if ASPECT_RATIOS[0] <= width / height <= ASPECT_RATIOS[1]:
+        dark = (gray < 60).sum() / max(1, (~panel).sum())
+        score = max(score, panel_match(panel) * min(1.0, dark / 0.6))
+    return score
+
+
+def check_receipt(image_bytes, threshold):
+    """Raise :class:`NotAReceiptError` if the image scores below threshold."""
+    score = receipt_score(image_bytes)
+    if score < threshold:
+        raise NotAReceiptError(round(score, 2))
+    return score
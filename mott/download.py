@@ -0,0 +1,126 @@
+"""
+Attachment downloads over one shared, pooled HTTP session.
+
+The session is opened when the bot starts and closed when it stops so that
+connections to the discord CDN are kept alive between attachments. Bodies are
+streamed with a byte budget and a deadline so that a large or slow attachment
+cannot exhaust memory or hold a connection.
+"""
+
+import asyncio
+import logging
+import os
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import aiohttp
+
+from mott.exceptions import MottException
+
+logger_discord = logging.getLogger("discord")
+
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(MottException):
+    def __init__(self, URI, message=""):
+        if message == "":
+            self.message = f"Failed to download: {URI}"
+        else:
+            self.message = message
+        super().__init__(self.message)
+
+
+def scaled_url(URI, width, height, max_height=None):
+    """Return the media proxy URL of a copy of an image scaled to max_height.
+
+    Returns None when the original is no higher or the URL cannot be parsed.
+    ``max_height`` defaults to ``DISCORD_BOT_DOWNLOAD_HEIGHT`` (900 pixels,
+    0 to always download the original). The receipt UI scales with the
+    screen height, so that bounds how small the amount text gets.
+    """
+    if max_height is None:
+        max_height = int(os.getenv("DISCORD_BOT_DOWNLOAD_HEIGHT", 900))
+    if not max_height or not width or not height or height <= max_height:
+        return None
+    try:
+        url = urlparse(URI)
+    except ValueError:
+        return None
+    if not url.scheme or not url.netloc:
+        return None
+    query = dict(parse_qsl(url.query))
+    query["width"] = str(round(width * max_height / height))
+    query["height"] = str(max_height)
+    return url._replace(query=urlencode(query)).geturl()
+
+
+_session = None
+_session_loop = None
+
+
+async def open_session():
+    """Return the shared session, opening it for the running loop if needed.
+
+    ``DISCORD_BOT_HTTP_CONNECTIONS`` and ``DISCORD_BOT_HTTP_CONNECTIONS_PER_HOST``
+    bound the connection pool (defaults: 32 and 8).
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.getenv("DISCORD_BOT_HTTP_CONNECTIONS", 32)),
+            limit_per_host=int(os.getenv("DISCORD_BOT_HTTP_CONNECTIONS_PER_HOST", 8)),
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+        _session_loop = loop
+        logger_discord.info("opened shared HTTP session")
+    return _session
+
+
+async def close_session():
+    global _session, _session_loop
+    if _session is not None:
+        await _session.close()
+        logger_discord.info("closed shared HTTP session")
+    _session = None
+    _session_loop = None
+
+
+async def download(URI, max_bytes=None, timeout=None):
+    """Stream URI into memory, failing beyond max_bytes or timeout seconds.
+
+    The limits default to ``DISCORD_BOT_DOWNLOAD_MAX_BYTES`` (25 MiB) and
+    ``DISCORD_BOT_DOWNLOAD_TIMEOUT`` (30 seconds).
+    """
+    if max_bytes is None:
+        max_bytes = int(os.getenv("DISCORD_BOT_DOWNLOAD_MAX_BYTES", 25 * 1024 * 1024))
+    if timeout is None:
+        timeout = float(os.getenv("DISCORD_BOT_DOWNLOAD_TIMEOUT", 30))
+
+    session = await open_session()
+    chunks = []
+    size = 0
+    try:
+        async with session.get(URI, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            if r.status != 200:
+                raise DownloadError(
+                    URI, message=f"Failed to read: {URI} status_code: {r.status}"
+                )
+            if r.content_length is not None and r.content_length > max_bytes:
+                raise DownloadError(
+                    URI, message=f"Image too large: {r.content_length} bytes"
+                )
+            async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise DownloadError(
+                        URI, message=f"Image too large: over {max_bytes} bytes"
+                    )
+                chunks.append(chunk)
+    except asyncio.TimeoutError:
+        raise DownloadError(URI, message=f"Timed out downloading: {URI}")
+    except aiohttp.ClientError as e:
+        raise DownloadError(URI, message=f"Failed to download: {URI} {e}")
+    return b"".join(chunks)
@@ -0,0 +1,178 @@
+"""
+Tesseract backends for the OCR workers.
+
+``pytesseract`` runs the ``tesseract`` binary once per image, ``tesserocr``
+keeps an in-process Tesseract API handle per worker so the language model is
+only loaded once per worker process.
+"""
+
+import logging
+import importlib.util
+import os
+
+import pytesseract
+from pytesseract import Output
+
+from mott.exceptions import MottException
+
+logger_discord = logging.getLogger("discord")
+
+DEFAULT_ENGINE = "pytesseract"
+
+
+class PytesseractEngine:
+    name = "pytesseract"
+
+    def __init__(self, lang="eng"):
+        self.lang = lang
+
+    def image_to_string(self, image, psm=4, timeout=0):
+        try:
+            return pytesseract.image_to_string(
+                image, lang=self.lang, config=f"--psm {psm}", timeout=timeout
+            )
+        except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+            # pytesseract errors cannot be pickled back to the bot process
+            raise MottException(f"OCR: tesseract failed: {e}")
+        except RuntimeError:
+            raise MottException(f"OCR: tesseract took over {timeout} seconds")
+
+    def image_to_data(self, image, psm=4, whitelist=None, timeout=0):
+        config = f"--psm {psm}"
+        if whitelist:
+            # quoted, the whitelist needs a space or tesseract merges the words
+            config += f' -c "tessedit_char_whitelist={whitelist}"'
+        try:
+            return pytesseract.image_to_data(
+                image,
+                lang=self.lang,
+                config=config,
+                output_type=Output.DICT,
+                timeout=timeout,
+            )
+        except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+            raise MottException(f"OCR: tesseract failed: {e}")
+        except RuntimeError:
+            # pytesseract kills tesseract when it runs past the timeout
+            raise MottException(f"OCR: tesseract took over {timeout} seconds")
+
+
+TSV_COLUMNS = (
+    "level",
+    "page_num",
+    "block_num",
+    "par_num",
+    "line_num",
+    "word_num",
+    "left",
+    "top",
+    "width",
+    "height",
+    "conf",
+    "text",
+)
+
+
+def parse_tsv(tsv):
+    """Convert tesseract's TSV output to pytesseract's ``Output.DICT`` layout."""
+    data = {column: [] for column in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        fields = row.split("\t")
+        if len(fields) != len(TSV_COLUMNS) or fields[0] == "level":
+            continue
+        for column, field in zip(TSV_COLUMNS[:-2], fields):
+            data[column].append(int(field))
+        data["conf"].append(float(fields[-2]))
+        data["text"].append(fields[-1])
+    return data
+
+
+def tessdata_path():
+    """The tessdata directory for tesserocr: ``TESSDATA_PREFIX`` if it is set,
+    otherwise the one tesserocr was built with."""
+    import tesserocr
+
+    path = os.getenv("TESSDATA_PREFIX") or tesserocr.get_languages()[0]
+    # tesseract expects the directory to end with a separator
+    return os.path.join(path, "")
+
+
+class TesserocrEngine:
+    name = "tesserocr"
+
+    def __init__(self, lang="eng"):
+        import tesserocr
+
+        self.lang = lang
+        self.path = tessdata_path()
+        try:
+            self.api = tesserocr.PyTessBaseAPI(path=self.path, lang=lang)
+        except RuntimeError as e:
+            raise MottException(
+                f"OCR: could not start tesserocr with tessdata {self.path}: {e}"
+            )
+
+    # the timeouts are ignored, tesseract cannot be interrupted in process
+
+    def image_to_string(self, image, psm=4, timeout=0):
+        self.api.SetPageSegMode(psm)
+        try:
+            self.api.SetImage(image)
+            return self.api.GetUTF8Text()
+        except RuntimeError as e:
+            raise MottException(f"OCR: tesserocr failed: {e}")
+        finally:
+            self.api.Clear()
+
+    def image_to_data(self, image, psm=4, whitelist=None, timeout=0):
+        self.api.SetPageSegMode(psm)
+        if whitelist:
+            self.api.SetVariable("tessedit_char_whitelist", whitelist)
+        try:
+            self.api.SetImage(image)
+            return parse_tsv(self.api.GetTSVText(0))
+        except RuntimeError as e:
+            raise MottException(f"OCR: tesserocr failed: {e}")
+        finally:
+            if whitelist:
+                self.api.SetVariable("tessedit_char_whitelist", "")
+            self.api.Clear()
+
+
+ENGINES = {
+    PytesseractEngine.name: PytesseractEngine,
+    TesserocrEngine.name: TesserocrEngine,
+}
+
+
+def available_engine(name):
+    """Return ``name`` if that engine can be used here, otherwise the default."""
+    if name not in ENGINES:
+        logger_discord.warning(f"unknown OCR engine: {name}, using {DEFAULT_ENGINE}")
+        return DEFAULT_ENGINE
+    if name == TesserocrEngine.name and importlib.util.find_spec("tesserocr") is None:
+        logger_discord.warning(
+            f"OCR engine {name} is not installed, using {DEFAULT_ENGINE}"
+        )
+        return DEFAULT_ENGINE
+    return name
+
+
+_engine = None
+
+
+def init_engine(name=DEFAULT_ENGINE):
+    """Load the engine for this worker process, called once per worker."""
+    global _engine
+    try:
+        _engine = ENGINES[name]()
+    except MottException as e:
+        # a broken initializer would take the whole pool down with it
+        logger_discord.error(f"{e.message}, using {DEFAULT_ENGINE}")
+        _engine = ENGINES[DEFAULT_ENGINE]()
+
+
+def get_engine():
+    if _engine is None:
+        init_engine()
+    return _engine
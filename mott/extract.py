@@ -0,0 +1,125 @@
+"""
+Amount extraction from tesseract output.
+
+A receipt amount is a grouped number followed by the aUEC currency token.
+Tesseract regularly misreads the token (``aVEC``, ``aUVEC``, ``aUEG`` ...) so
+the token pattern accepts the common confusions, and digit groups may be
+separated by any of the usual locale grouping characters as long as one
+number uses a single separator.
+"""
+
+import logging
+import re
+from collections import namedtuple
+
+from mott.exceptions import MottException
+
+logger_discord = logging.getLogger("discord")
+
+
+class OCRaUECNotFoundError(MottException):
+    def __init__(self, contents, message=""):
+        if message == "":
+            self.message = f"OCR: aUEC not found in image contents"
+        else:
+            self.message = message
+        logger_discord.debug(f"Failed to detect aUEC in image contents: '{contents}'")
+        super().__init__(self.message)
+
+
+class OCRNumberNotFoundError(MottException):
+    def __init__(self, number_string, message=""):
+        if message == "":
+            self.message = f"OCR: number not found in image contents"
+        else:
+            self.message = message
+        logger_discord.debug(f"Failed to detect a number of aUEC in: '{number_string}'")
+        super().__init__(self.message)
+
+
+# value in aUEC and the tesseract confidence of its digits from 0 to 1
+Amount = namedtuple("Amount", ["value", "confidence"])
+
+CURRENCY = r"a(?:uv|vu|u|v)[ef][cg(]"
+CURRENCY_PATTERN = re.compile(CURRENCY, re.IGNORECASE)
+# the whitespace in front of the currency token in free text
+CURRENCY_START_PATTERN = re.compile(rf"\s(?={CURRENCY})", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(
+    r"(?<!\d)(\d{1,3}(?:([,.' \u2009\u202f])\d{3})(?:\2\d{3})*|\d+)\s*$"
+)
+DIGITS_PATTERN = re.compile(r"[\d,.' \u2009\u202f]+")
+# a tesseract whitelist for text that is only an amount
+AMOUNT_CHARACTERS = "0123456789,.' aUEC"
+
+
+def currency_start(contents) -> int:
+    """Return the index of the whitespace before the first currency token."""
+    match = CURRENCY_START_PATTERN.search(contents)
+    if match is None:
+        raise OCRaUECNotFoundError(contents)
+    return match.start()
+
+
+def parse_number(number_string) -> int:
+    """Parse the grouped number at the end of number_string."""
+    match = NUMBER_PATTERN.search(number_string)
+    if match is None:
+        raise OCRNumberNotFoundError(number_string)
+    return int(re.sub(r"\D", "", match.group(1)))
+
+
+def amount_from_text(contents) -> int:
+    """Return the aUEC value in tesseract's plain text output."""
+    number_end = currency_start(contents)
+    try:
+        return parse_number(contents[:number_end])
+    except OCRNumberNotFoundError:
+        raise OCRNumberNotFoundError(contents)
+
+
+def _lines(data):
+    """Group the words of tesseract's ``image_to_data`` output by text line."""
+    lines = {}
+    for i, text in enumerate(data["text"]):
+        text = str(text).strip()
+        if text == "":
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append((text, float(data["conf"][i])))
+    return lines.values()
+
+
+def amount_from_data(data) -> Amount:
+    """Return the best aUEC amount in tesseract's ``image_to_data`` output.
+
+    Each currency token is paired with the run of numeric words directly in
+    front of it on the same line. When several lines hold an amount the one
+    whose digits tesseract is most confident about wins.
+    """
+    amounts = []
+    found_currency = False
+    for words in _lines(data):
+        for i, (text, _) in enumerate(words):
+            if not CURRENCY_PATTERN.match(text):
+                continue
+            found_currency = True
+            digits = []
+            for word, conf in reversed(words[:i]):
+                if not DIGITS_PATTERN.fullmatch(word):
+                    break
+                digits.insert(0, (word, conf))
+            if not digits:
+                continue
+            try:
+                value = parse_number(" ".join(word for word, _ in digits))
+            except OCRNumberNotFoundError:
+                continue
+            confidence = min(conf for _, conf in digits) / 100
+            amounts.append(Amount(value, max(0.0, confidence)))
+
+    contents = " ".join(text for words in _lines(data) for text, _ in words)
+    if not found_currency:
+        raise OCRaUECNotFoundError(contents)
+    if not amounts:
+        raise OCRNumberNotFoundError(contents)
+    return max(amounts, key=lambda amount: amount.confidence)
@@ -0,0 +1,199 @@
+"""
+Compact form of an account's transactions, as returned by ``all``.
+
+A :class:`Ledger` keeps each field of the transactions in a typed array, with
+user ids interned in a table of their own, and rebuilds the totals of an
+account with numpy over the arrays. The sqlite backend reads its rows
+straight into one. The TinyDB backends build it from the documents their
+storage already holds in memory, so there it is a quicker result to iterate
+and total, not a saving in memory. Rows are read through :class:`Transaction`
+views, which behave like the documents they replace.
+"""
+
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+VERIFIED = 1
+
+FIELDS = ("message_id", "timestamp", "user_id", "value", "ocr-verified")
+
+
+class Transaction(Mapping):
+    """Read-only view of one row of a :class:`Ledger`."""
+
+    __slots__ = ("_ledger", "_row")
+
+    def __init__(self, ledger, row):
+        self._ledger = ledger
+        self._row = row
+
+    @property
+    def doc_id(self):
+        return self._ledger.doc_ids[self._row]
+
+    def __getitem__(self, key):
+        ledger, row = self._ledger, self._row
+        if key == "message_id":
+            return ledger.message_ids[row]
+        if key == "timestamp":
+            return ledger.timestamps[row]
+        if key == "user_id":
+            return ledger.user_ids[ledger.users[row]]
+        if key == "value":
+            return ledger.values[row]
+        if key == "ocr-verified":
+            return bool(ledger.flags[row] & VERIFIED)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __repr__(self):
+        return f"Transaction({dict(self)!r}, doc_id={self.doc_id})"
+
+
+class Ledger:
+    """The transactions of one account as parallel typed arrays.
+
+    Message ids, timestamps and values are 64-bit integers. Amounts are
+    whole aUEC, but values are kept as doubles once a float is added, or as
+    a list of Python ints once one does not fit in 64 bits, so that every
+    value reads back as it was given. Rows keep the order they were appended
+    in.
+    """
+
+    __slots__ = (
+        "doc_ids",
+        "message_ids",
+        "timestamps",
+        "values",
+        "flags",
+        "users",
+        "user_ids",
+        "_user_index",
+    )
+
+    def __init__(self):
+        self.doc_ids = array("q")
+        self.message_ids = array("q")
+        self.timestamps = array("q")
+        self.values = array("q")
+        self.flags = array("B")
+        # index into user_ids of the user of each row
+        self.users = array("i")
+        self.user_ids = []
+        self._user_index = {}
+
+    @classmethod
+    def from_documents(cls, documents):
+        ledger = cls()
+        for doc in documents:
+            ledger.append(doc.doc_id, doc)
+        return ledger
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a ledger from (doc_id, message_id, timestamp, user_id, value,
+        verified) tuples."""
+        ledger = cls()
+        for row in rows:
+            ledger.append_row(*row)
+        return ledger
+
+    def _intern(self, user_id):
+        index = self._user_index.get(user_id)
+        if index is None:
+            index = self._user_index[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return index
+
+    def append_row(self, doc_id, message_id, timestamp, user_id, value, verified):
+        self.doc_ids.append(doc_id)
+        self.message_ids.append(message_id)
+        self.timestamps.append(timestamp)
+        if isinstance(self.values, array):
+            if isinstance(value, float) and self.values.typecode == "q":
+                self.values = array("d", self.values)
+            try:
+                self.values.append(value)
+            except OverflowError:
+                self.values = [*self.values, value]
+        else:
+            self.values.append(value)
+        self.flags.append(VERIFIED if verified else 0)
+        self.users.append(self._intern(user_id))
+
+    def append(self, doc_id, transaction):
+        self.append_row(doc_id, *(transaction[field] for field in FIELDS))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return Transaction(self, row)
+
+    def __iter__(self):
+        return (Transaction(self, row) for row in range(len(self)))
+
+    def totals(self):
+        """Count, balance, withdrawals and ``[user_id, total, count]``
+        contributions, in the form of :data:`mott.accounts.ZERO_TOTALS`.
+
+        Contributors are in order of their first payment.
+        """
+        if not isinstance(self.values, array):
+            return self._python_totals()
+        dtype = np.int64 if self.values.typecode == "q" else np.float64
+        values = np.frombuffer(self.values, dtype=dtype)
+        if dtype is np.int64 and len(values):
+            # a sum that could pass 64 bits is left to Python ints
+            largest = max(int(values.max()), -int(values.min()))
+            if largest * len(values) >= 2**63:
+                return self._python_totals()
+        users = np.frombuffer(self.users, dtype=np.dtype(f"i{self.users.itemsize}"))
+        paid = values >= 0
+        totals = np.zeros(len(self.user_ids), dtype=dtype)
+        np.add.at(totals, users[paid], values[paid])
+        counts = np.bincount(users[paid], minlength=len(self.user_ids))
+        contributors, first = np.unique(users[paid], return_index=True)
+        # item() keeps integer amounts as ints
+        return {
+            "count": len(self),
+            "balance": values.sum().item(),
+            "withdrawls": -values[~paid].sum().item(),
+            "contributions": [
+                [self.user_ids[user], totals[user].item(), counts[user].item()]
+                for user in contributors[np.argsort(first)]
+            ],
+        }
+
+    def _python_totals(self):
+        balance = 0
+        withdrawls = 0
+        contributions = {}
+        for user, value in zip(self.users, self.values):
+            balance += value
+            if value < 0:
+                withdrawls -= value
+            else:
+                contribution = contributions.setdefault(user, [0, 0])
+                contribution[0] += value
+                contribution[1] += 1
+        return {
+            "count": len(self),
+            "balance": balance,
+            "withdrawls": withdrawls,
+            "contributions": [
+                [self.user_ids[user], total, count]
+                for user, (total, count) in contributions.items()
+            ],
+        }
@@ -1,14 +1,33 @@
-import itertools
+import asyncio
+import dataclasses
+import functools
 import logging
-from PIL import Image, ImageOps
-import pytesseract
+import math
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from PIL import Image
 import validators
-import aiohttp
 import io
 
 logger_discord = logging.getLogger("discord")
 
 from mott.exceptions import MottException
+from mott.engine import DEFAULT_ENGINE, available_engine, get_engine, init_engine
+from mott.classify import NotAReceiptError, check_receipt
+from mott.cache import CachedFailure, OCRCache
+from mott.download import download
+from mott.extract import (
+    AMOUNT_CHARACTERS,
+    Amount,
+    OCRaUECNotFoundError,
+    OCRNumberNotFoundError,
+    amount_from_data,
+    amount_from_text,
+    currency_start,
+)
 from urllib.parse import urlparse
 
 
@@ -21,26 +40,51 @@ class OCRInvalidURLError(MottException):
         super().__init__(self.message)
 
 
-class OCRaUECNotFoundError(MottException):
-    def __init__(self, contents, message=""):
+class OCRTimeoutError(MottException):
+    def __init__(self, URI, message=""):
+        if message == "":
+            self.message = f"OCR: timed out reading image: {URI}"
+        else:
+            self.message = message
+        super().__init__(self.message)
+
+
+class OCRImageTooLargeError(MottException):
+    def __init__(self, size, message=""):
         if message == "":
-            self.message = f"OCR: aUEC not found in image contents"
+            self.message = f"OCR: image too large to read: {size}"
         else:
             self.message = message
-        logger_discord.debug(f"Failed to detect aUEC in image contents: '{contents}'")
         super().__init__(self.message)
 
 
-class OCRNumberNotFoundError(MottException):
-    def __init__(self, number_string, message=""):
+class OCRImageUnreadableError(MottException):
+    def __init__(self, error, message=""):
         if message == "":
-            self.message = f"OCR: number not found in image contents"
+            self.message = f"OCR: could not decode image: {error}"
         else:
             self.message = message
-        logger_discord.debug(f"Failed to detect a number of aUEC in: '{number_string}'")
         super().__init__(self.message)
 
 
+# parse failures and oversized images are a property of the image and are
+# worth caching, anything else (e.g. tesseract not starting) is not
+OCR_FAILURES = {
+    e.__name__: e
+    for e in (
+        NotAReceiptError,
+        OCRImageTooLargeError,
+        OCRImageUnreadableError,
+        OCRaUECNotFoundError,
+        OCRNumberNotFoundError,
+    )
+}
+
+
+# images turned away by the receipt classifier and images that went on to OCR
+ocr_counts = Counter()
+
+
 def uri_validator(x):
     try:
         result = urlparse(x)
@@ -49,20 +93,437 @@ def uri_validator(x):
         return False
 
 
-def convert_image_format(image, output_format=None):
-    new_image = image
-    if output_format and (image.format != output_format):
-        image_bytes = io.BytesIO()
-        image.save(image_bytes, output_format)
-        new_image = Image.open(image_bytes)
-    return new_image
+_ocr_pool = None
+
+
+@functools.lru_cache(maxsize=None)
+def _available_engine(name):
+    return available_engine(name)
+
+
+def requested_engine():
+    """The engine ``DISCORD_BOT_OCR_ENGINE`` asks for, if it can be used here."""
+    return _available_engine(os.getenv("DISCORD_BOT_OCR_ENGINE", DEFAULT_ENGINE))
+
+
+def get_ocr_pool():
+    """Return the process pool that OCR jobs run in, creating it on first use.
+
+    The pool size is read from ``DISCORD_BOT_OCR_WORKERS`` (default: one
+    worker per CPU) and each worker process is replaced after
+    ``DISCORD_BOT_OCR_MAX_TASKS_PER_WORKER`` jobs (default: 100, 0 to never
+    recycle) so that leaks in tesseract or PIL cannot accumulate.
+    ``DISCORD_BOT_OCR_ENGINE`` selects the tesseract backend each worker
+    loads when it starts, see :mod:`mott.engine`.
+    """
+    global _ocr_pool
+    if _ocr_pool is None:
+        workers = int(os.getenv("DISCORD_BOT_OCR_WORKERS", os.cpu_count() or 1))
+        max_tasks = int(os.getenv("DISCORD_BOT_OCR_MAX_TASKS_PER_WORKER", 100))
+        engine = requested_engine()
+        logger_discord.info(
+            f"starting OCR pool: {workers} {engine} workers,"
+            f" recycled every {max_tasks} jobs"
+        )
+        _ocr_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            max_tasks_per_child=max_tasks or None,
+            initializer=init_engine,
+            initargs=(engine,),
+        )
+    return _ocr_pool
+
+
+def shutdown_ocr_pool():
+    global _ocr_pool
+    if _ocr_pool is not None:
+        logger_discord.info("shutting down OCR pool")
+        _ocr_pool.shutdown(wait=True, cancel_futures=True)
+        _ocr_pool = None
+
+
+def recycle_ocr_pool(pool):
+    """Stop the workers of pool and leave the next job a fresh pool.
+
+    A job that has started in a worker cannot be cancelled, so this is how a
+    read that timed out, or whose message was deleted, is stopped instead of
+    holding a worker (tesserocr has no timeout of its own). Other jobs
+    running in the pool fail with ``BrokenProcessPool``.
+    """
+    global _ocr_pool
+    if _ocr_pool is pool:
+        _ocr_pool = None
+    logger_discord.info("recycling OCR pool to stop an abandoned job")
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    for process in processes:
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def read_in_pool(image_bytes, config, timeout=None):
+    """Run read_tiered in the OCR pool and wait at most timeout for it.
+
+    Returns only once the job has stopped: when the wait times out or is
+    cancelled a job that is already running is stopped by recycling the pool,
+    so whoever awaits this can count on the worker being free again. A job
+    lost to another job's recycling is run once more on the new pool.
+    """
+    for attempt in range(2):
+        pool = get_ocr_pool()
+        job = pool.submit(read_tiered, image_bytes, config)
+        result = asyncio.wrap_future(job)
+        try:
+            return await asyncio.wait_for(asyncio.shield(result), timeout)
+        except BrokenProcessPool:
+            recycle_ocr_pool(pool)
+            if attempt:
+                raise
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if not job.cancel():
+                recycle_ocr_pool(pool)
+            await asyncio.wait({result})
+            if not result.cancelled():
+                # retrieved so that a killed job is not logged as unhandled
+                result.exception()
+            raise
+
+
+# bump when a change to the OCR code reads the same image differently, so that
+# the results persisted by older versions are not reused
+PIPELINE_VERSION = 1
+
+
+def cache_version(config):
+    """The part of an OCR cache key naming how its image was read."""
+    return f"{PIPELINE_VERSION}:{requested_engine()}:{config!r}"
+
+
+_ocr_cache = None
+
+
+def get_ocr_cache():
+    """Return the OCR result cache, creating it on first use.
+
+    ``DISCORD_BOT_OCR_CACHE_SIZE`` bounds the in-memory LRU (default: 1024
+    images, 0 disables it) and ``DISCORD_BOT_OCR_CACHE_PERSIST=1`` adds an
+    sqlite tier next to the account databases in ``DISCORD_BOT_DB_DIR``.
+    """
+    global _ocr_cache
+    if _ocr_cache is None:
+        capacity = int(os.getenv("DISCORD_BOT_OCR_CACHE_SIZE", 1024))
+        path = None
+        if os.getenv("DISCORD_BOT_OCR_CACHE_PERSIST", "0") == "1":
+            path = f"{os.getenv('DISCORD_BOT_DB_DIR')}/ocr_cache.db"
+        _ocr_cache = OCRCache(capacity, path)
+    return _ocr_cache
+
+
+def close_ocr_cache():
+    global _ocr_cache
+    if _ocr_cache is not None:
+        _ocr_cache.close()
+        _ocr_cache = None
+
+
+@dataclasses.dataclass(frozen=True)
+class OCRConfig:
+    """Per-job OCR pipeline settings, passed to the worker with each image."""
+
+    roi: bool = True
+    binarise: bool = False
+    max_width: int = 0
+    max_pixels: int = 40_000_000
+    min_receipt_score: float = 0.4
+    tiered: bool = True
+    fast_width: int = 1280
+    min_confidence: float = 0.6
+    tesseract_timeout: float = 20
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            roi=os.getenv("DISCORD_BOT_OCR_ROI", "1") == "1",
+            binarise=os.getenv("DISCORD_BOT_OCR_BINARISE", "0") == "1",
+            max_width=int(os.getenv("DISCORD_BOT_OCR_MAX_WIDTH", 0)),
+            max_pixels=int(os.getenv("DISCORD_BOT_OCR_MAX_PIXELS", 40_000_000)),
+            min_receipt_score=float(
+                os.getenv("DISCORD_BOT_OCR_MIN_RECEIPT_SCORE", 0.4)
+            ),
+            tiered=os.getenv("DISCORD_BOT_OCR_TIERED", "1") == "1",
+            fast_width=int(os.getenv("DISCORD_BOT_OCR_FAST_WIDTH", 1280)),
+            min_confidence=float(os.getenv("DISCORD_BOT_OCR_MIN_CONFIDENCE", 0.6)),
+            tesseract_timeout=float(os.getenv("DISCORD_BOT_OCR_TESSERACT_TIMEOUT", 20)),
+        )
+
+
+def _runs(mask, max_gap=1):
+    """Split the indices where mask is True into runs of consecutive indices."""
+    idx = np.flatnonzero(mask)
+    if len(idx) == 0:
+        return []
+    return np.split(idx, np.flatnonzero(np.diff(idx) > max_gap) + 1)
+
+
+def locate_amount(image, pixels=None, working_width=400):
+    """Find the candidate amount lines of a mo.trader receipt.
+
+    The transfer panel is the large grey, unsaturated block on an otherwise
+    dark screen, so it is found from row and column projections of a
+    downscaled copy of the colour image. Inside the panel the amount is one of
+    the tallest lines of bright text in the lower half of the grayscale
+    pixels, the lowest of them in the current UI. Returns the (left, upper, right,
+    lower) boxes of those lines in pixels coordinates, lowest first, or an
+    empty list when no panel is found.
+    """
+    if pixels is None:
+        pixels = np.asarray(image.convert("L"))
+    scale = max(1, image.width // working_width)
+    small = np.asarray(image.reduce(scale), dtype=np.int16)[:, :, :3]
+    gray = small.mean(axis=2)
+    saturation = small.max(axis=2) - small.min(axis=2)
+    panel = (gray > 70) & (gray < 200) & (saturation < 40)
+
+    columns = panel.mean(axis=0)
+    columns = _runs(columns > 0.5 * columns.max(), max_gap=2)
+    if not columns:
+        return []
+    columns = max(columns, key=len)
+    rows = _runs(panel[:, columns[0] : columns[-1] + 1].mean(axis=1) > 0.5, 2)
+    if not rows:
+        return []
+    rows = max(rows, key=len)
+    # panel edges in pixels coordinates, which may be downscaled from image
+    x_scale = scale * pixels.shape[1] / image.width
+    y_scale = scale * pixels.shape[0] / image.height
+    left, right = int(columns[0] * x_scale), int((columns[-1] + 1) * x_scale)
+    upper, lower = int(rows[0] * y_scale), int((rows[-1] + 1) * y_scale)
+    if (right - left) < pixels.shape[1] // 10 or (lower - upper) < pixels.shape[0] // 5:
+        return []
+
+    # text is well above the panel background, wherever downscaling left it
+    panel = pixels[upper:lower, left:right]
+    background, brightest = np.percentile(panel, (50, 99.5))
+    weights = (panel > (background + brightest) / 2).sum(axis=1)
+    lines = [
+        (line, weights[line].sum())
+        for line in _runs(weights > 2)
+        if len(line) > 2 and line[0] > len(weights) // 2
+    ]
+    if not lines:
+        return []
+    # the amount is set as large as the title, short amounts are light though
+    tallest = max(len(line) for line, _ in lines)
+    boxes = []
+    for line, weight in reversed(lines):
+        if len(line) < 0.75 * tallest:
+            continue
+        pad = len(line) // 2 + 1
+        boxes.append(
+            (
+                left,
+                int(max(upper, upper + line[0] - pad)),
+                right,
+                int(min(lower, upper + line[-1] + pad)),
+            )
+        )
+    return boxes
+
+
+def otsu_threshold(histogram):
+    """Return the level that best separates a 256 bin histogram in two."""
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)
+    mean = np.cumsum(histogram * levels)
+    total = weight[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mean[-1] * weight - mean * total) ** 2 / (weight * (total - weight))
+    return int(np.nanargmax(between)) if np.isfinite(between).any() else 127
+
+
+def contrast_lut(histogram, cutoff, binarise=False):
+    """Build the lookup table that inverts and contrast stretches pixels.
+
+    Equivalent to ``ImageOps.invert`` followed by ``ImageOps.autocontrast``
+    with the same cutoff percentages, optionally followed by an Otsu
+    threshold, computed from the 256 bin histogram of the original pixels.
+    """
+    inverted = histogram[::-1]
+    n = inverted.sum()
+    lo = int(np.searchsorted(np.cumsum(inverted), n * cutoff[0] / 100, "right"))
+    hi = 255 - int(np.searchsorted(np.cumsum(histogram), n * cutoff[1] / 100, "right"))
+    values = 255 - np.arange(256)
+    if hi > lo:
+        values = np.clip((values - lo) * 255 / (hi - lo), 0, 255)
+    lut = values.astype(np.uint8)
+    if binarise:
+        threshold = otsu_threshold(np.bincount(lut, weights=histogram, minlength=256))
+        lut = np.where(lut > threshold, 255, 0).astype(np.uint8)
+    return lut
+
+
+def preprocess(pixels, cutoff, binarise=False, out=None):
+    """Invert and contrast stretch 8-bit grayscale pixels in one table lookup.
+
+    Pass ``out=pixels`` to reuse the decoded buffer instead of allocating.
+    """
+    histogram = np.bincount(pixels.ravel(), minlength=256)
+    lut = contrast_lut(histogram, cutoff, binarise)
+    return np.take(lut, pixels, out=out, mode="clip")
+
+
+def open_image(image_bytes, max_width=0, max_pixels=0):
+    """Open an image without decoding it, ready to decode at a reduced scale.
+
+    JPEGs are set to decode straight to the smallest power of two scale that
+    is still at least max_width wide, or that fits in max_pixels. Any other
+    image larger than max_pixels is rejected before its pixels are allocated.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise OCRImageTooLargeError(e)
+    except OSError as e:
+        # UnidentifiedImageError, e.g. an SVG attachment
+        raise OCRImageUnreadableError(e)
+    if max_width and image.width > max_width:
+        image.draft(image.mode, (max_width, image.height * max_width // image.width))
+    if max_pixels and image.width * image.height > max_pixels:
+        # JPEGs decode at 1/2, 1/4 or 1/8 scale
+        scale = 2 ** math.ceil(
+            math.log2(math.sqrt(image.width * image.height / max_pixels))
+        )
+        if scale <= 8:
+            image.draft(
+                image.mode,
+                (math.ceil(image.width / scale), math.ceil(image.height / scale)),
+            )
+        if image.width * image.height > max_pixels:
+            raise OCRImageTooLargeError(f"{image.width}x{image.height}")
+    return image
+
+
+def decode(image_bytes, max_width=0, max_pixels=0):
+    """Decode an image, returning it and its 8-bit grayscale pixels.
+
+    The grayscale pixels are downscaled to max_width wide, when max_width is
+    set, see :func:`open_image` for max_pixels.
+    """
+    image = open_image(image_bytes, max_width, max_pixels)
+    try:
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGB")
+        gray = image.convert("L")
+    except OSError as e:
+        # a truncated or corrupt image only fails once its pixels are read
+        raise OCRImageUnreadableError(e)
+    if max_width and gray.width > max_width:
+        height = max(1, gray.height * max_width // gray.width)
+        gray = gray.resize((max_width, height), Image.BOX)
+    return image, np.array(gray)
+
+
+def _pixels_to_amount(pixels, psm, whitelist=None, timeout=0):
+    image = Image.fromarray(pixels)
+    return amount_from_data(
+        get_engine().image_to_data(image, psm=psm, whitelist=whitelist, timeout=timeout)
+    )
+
+
+def read_fast(image_bytes, config=OCRConfig()):
+    """Read the amount line of a small copy of the image.
+
+    The image is reduced to at most ``config.fast_width`` pixels wide and
+    only the characters of an amount are allowed, which is enough for most
+    receipts at a fraction of the cost of :func:`read_full`. The line is only
+    binarised with ``config.binarise``, thresholding it after downscaling
+    turns 6s into confident 8s.
+    """
+    image, pixels = decode(image_bytes, config.fast_width, config.max_pixels)
+    boxes = locate_amount(image, pixels) if image.mode != "L" else []
+    del image
+    for left, upper, right, lower in boxes:
+        line = preprocess(pixels[upper:lower, left:right], (0, 50), config.binarise)
+        try:
+            return _pixels_to_amount(
+                line, 7, AMOUNT_CHARACTERS, config.tesseract_timeout
+            )
+        except tuple(OCR_FAILURES.values()):
+            pass
+    raise OCRaUECNotFoundError("", message="OCR: no amount line found")
+
+
+def read_full(image_bytes, config=OCRConfig()):
+    """Read the amount at ``config.max_width``, by default full resolution.
+
+    With ``config.roi`` only the amount lines found by :func:`locate_amount`
+    are read, falling back to the whole frame if none can be found or parsed.
+    """
+    image, pixels = decode(image_bytes, config.max_width, config.max_pixels)
+    boxes = []
+    if config.roi and image.mode != "L":
+        boxes = locate_amount(image, pixels)
+    del image
+    for left, upper, right, lower in boxes:
+        # the line is mostly background, so keep the brightest half
+        line = preprocess(pixels[upper:lower, left:right], (0, 50), config.binarise)
+        try:
+            return _pixels_to_amount(line, 7, timeout=config.tesseract_timeout)
+        except tuple(OCR_FAILURES.values()):
+            pass
+    preprocess(pixels, (0, 95), config.binarise, out=pixels)
+    return _pixels_to_amount(pixels, 4, timeout=config.tesseract_timeout)
+
+
+def read_tiered(image_bytes, config=OCRConfig()):
+    """Read the aUEC amount from an encoded image, run inside an OCR worker.
+
+    Images of more than ``config.max_pixels`` that cannot be decoded at a
+    reduced scale, and images that :func:`mott.classify.receipt_score` puts
+    below ``config.min_receipt_score``, are rejected before they are fully
+    decoded. With ``config.tiered`` :func:`read_fast` is tried first and the image is
+    only read again by :func:`read_full` when that fails or is less than
+    ``config.min_confidence`` sure. Returns the amount and the name of the
+    tier that read it.
+    """
+    # the receipt classifier decodes the image too
+    open_image(image_bytes, max_pixels=config.max_pixels)
+    if config.min_receipt_score > 0:
+        try:
+            check_receipt(image_bytes, config.min_receipt_score)
+        except OSError as e:
+            raise OCRImageUnreadableError(e)
+    fast = None
+    if config.tiered:
+        try:
+            fast = read_fast(image_bytes, config)
+        except tuple(OCR_FAILURES.values()):
+            pass
+        else:
+            if fast.confidence >= config.min_confidence:
+                return fast, "fast"
+    try:
+        amount = read_full(image_bytes, config)
+    except tuple(OCR_FAILURES.values()):
+        if fast is None:
+            raise
+        return fast, "fast"
+    if fast is not None and fast.confidence > amount.confidence:
+        return fast, "fast"
+    return amount, "full"
+
+
+def read_amount(image_bytes, config=OCRConfig()):
+    """Read the aUEC amount from an encoded image, see :func:`read_tiered`."""
+    amount, _ = read_tiered(image_bytes, config)
+    return amount
 
 
 class OCR:
     @classmethod
-    async def create(cls, URI):
+    async def create(cls, URI, config=None):
         self = cls()
         self.uri = URI
+        self.config = config or OCRConfig.from_env()
         if uri_validator(self.uri):
             validation = True
             try:
@@ -72,54 +533,62 @@ class OCR:
             if not validation:
                 raise OCRInvalidURLError(self.uri)
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.uri) as r:
-                    if r.status != 200:
-                        raise MottException(
-                            f"Failed to read: {self.uri} status_code: {r.status_code}"
-                        )
-                    req_contents = await r.read()
-                    self.image = Image.open(io.BytesIO(req_contents))
+            self.image_bytes = await download(self.uri)
         else:
-            self.image = Image.open(self.uri)
+            with open(self.uri, "rb") as f:
+                self.image_bytes = f.read()
         return self
 
-    def contains_auec(self, contents) -> int:
-        auec_variants = []
-        for auec in [" auec", " avec", " auvec", " avuec"]:
-            auec_variants += map(
-                "".join, itertools.product(*zip(auec.upper(), auec.lower()))
-            )
+    @staticmethod
+    def contains_auec(contents) -> int:
+        return currency_start(contents)
+
+    @staticmethod
+    def auec_value(contents):
+        return amount_from_text(contents)
 
-        number_end = -1
-        for auec_str in auec_variants:
-            number_end = contents.find(auec_str)
-            if number_end >= 0:
-                break
-        if number_end < 0:
-            raise OCRaUECNotFoundError(contents)
-        return number_end
-
-    def auec_value(self, contents):
-        number_end = self.contains_auec(contents)
-
-        number_string = ""
-        for c in contents[number_end::-1].strip():
-            if c.isspace() or c.isalpha() and c != ",":
-                break
-            elif c != ",":
-                number_string += c
+    async def image_to_amount(self) -> Amount:
+        cache = get_ocr_cache()
+        key = cache.key(self.image_bytes, cache_version(self.config))
+        cached = await cache.fetch(key)
+        if isinstance(cached, CachedFailure):
+            logger_discord.info(f' cached OCR failure for image URI: "{self.uri}"')
+            raise OCR_FAILURES[cached.error](key, message=cached.message)
+        if cached is not None:
+            logger_discord.info(f' cached OCR result for image URI: "{self.uri}"')
+            return cached
+
+        logger_discord.info(f' processing image URI: "{self.uri}"')
+        timeout = float(os.getenv("DISCORD_BOT_OCR_TIMEOUT", 60))
         try:
-            value = int(number_string[::-1])
-        except ValueError:
-            raise OCRNumberNotFoundError(contents)
-        return value
+            amount, tier = await read_in_pool(
+                self.image_bytes, self.config, timeout or None
+            )
+        except asyncio.TimeoutError:
+            ocr_counts["timed_out"] += 1
+            raise OCRTimeoutError(self.uri)
+        except NotAReceiptError as e:
+            ocr_counts["skipped"] += 1
+            logger_discord.info(
+                f" skipped image that is not a receipt: {self.uri},"
+                f" {ocr_counts['skipped']} skipped, {ocr_counts['processed']} read"
+            )
+            await cache.store(key, CachedFailure(type(e).__name__, e.message))
+            raise
+        except tuple(OCR_FAILURES.values()) as e:
+            ocr_counts["processed"] += 1
+            await cache.store(key, CachedFailure(type(e).__name__, e.message))
+            raise
+        ocr_counts["processed"] += 1
+        ocr_counts[f"tier_{tier}"] += 1
+        logger_discord.info(
+            f" read by the {tier} OCR tier, the fast tier was enough for"
+            f" {ocr_counts['tier_fast']} of"
+            f" {ocr_counts['tier_fast'] + ocr_counts['tier_full']} images"
+        )
+        await cache.store(key, amount)
+        return amount
 
     async def image_to_auec(self) -> float:
-        logger_discord.info(f' processing image URI: "{self.uri}"')
-        self.image = convert_image_format(self.image, output_format="PNG")
-        self.image = self.image.convert("RGB")
-        self.image = ImageOps.invert(self.image)
-        self.image = ImageOps.autocontrast(self.image, cutoff=(0, 95))
-        contents = pytesseract.image_to_string(self.image, config=r"--psm 4")
-        return self.auec_value(contents)
+        amount = await self.image_to_amount()
+        return amount.value
@@ -0,0 +1,188 @@
+"""
+Fair, bounded scheduling of OCR jobs.
+
+Jobs are queued per guild and per channel and a fixed number of workers take
+them round-robin, first across guilds and then across the channels of a
+guild, so one guild flooding receipts cannot starve the others. The queue is
+bounded: once it is full :meth:`OCRScheduler.submit` waits for space, which
+pushes back on the callers instead of letting memory and latency grow.
+
+Jobs may be tagged, e.g. with the id of the message they were queued for, so
+that :meth:`OCRScheduler.cancel` can drop them, queued or running, when that
+message is deleted.
+"""
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+
+# how many cancelled tags are remembered for jobs that are yet to be submitted
+CANCELLED_TAGS = 1024
+
+logger_discord = logging.getLogger("discord")
+
+
+class OCRScheduler:
+    def __init__(self, concurrency=4, capacity=64):
+        self.concurrency = concurrency
+        self.capacity = capacity
+        self._queues = OrderedDict()
+        self._running = {}
+        self._cancelled = OrderedDict()
+        self._workers = []
+        self._loop = None
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queues.clear()
+        self._space = asyncio.Semaphore(self.capacity)
+        self._queued = asyncio.Semaphore(0)
+        self._workers = [
+            loop.create_task(self._work()) for _ in range(self.concurrency)
+        ]
+
+    def full(self):
+        """True when the next :meth:`submit` will have to wait for space."""
+        return self._loop is not None and self._space.locked()
+
+    def __len__(self):
+        return sum(
+            len(jobs)
+            for channels in self._queues.values()
+            for jobs in channels.values()
+        )
+
+    async def submit(self, guild_id, channel_id, job, tag=None):
+        """Queue the coroutine function job and return a future of its result.
+
+        Waits while the queue is full. The future is cancelled if tag is, or
+        already was, cancelled.
+        """
+        self._start()
+        await self._space.acquire()
+        future = self._loop.create_future()
+        if tag is not None and tag in self._cancelled:
+            self._space.release()
+            future.cancel()
+            return future
+        channels = self._queues.setdefault(guild_id, OrderedDict())
+        channels.setdefault(channel_id, deque()).append((job, future, tag))
+        self._queued.release()
+        return future
+
+    async def run(self, guild_id, channel_id, job, tag=None):
+        """Queue job and wait for its result."""
+        return await (await self.submit(guild_id, channel_id, job, tag))
+
+    def cancel(self, tag):
+        """Cancel the queued and running jobs tagged with tag.
+
+        Running jobs are cancelled at their next await and keep their slot
+        until they return, so a job has to stop any work it handed to another
+        process or thread before the slot is taken again. Returns the number
+        of jobs cancelled.
+        """
+        self._cancelled[tag] = True
+        self._cancelled.move_to_end(tag)
+        while len(self._cancelled) > CANCELLED_TAGS:
+            self._cancelled.popitem(last=False)
+        cancelled = 0
+        for channels in self._queues.values():
+            for jobs in channels.values():
+                for _, future, job_tag in jobs:
+                    # the workers skip them when they reach them
+                    if job_tag == tag and future.cancel():
+                        cancelled += 1
+        for task, job_tag in self._running.items():
+            if job_tag == tag and task.cancel():
+                cancelled += 1
+        return cancelled
+
+    def cancelled(self, tag):
+        """Whether the jobs tagged with tag have been cancelled."""
+        return tag in self._cancelled
+
+    def _next(self):
+        guild_id, channels = next(iter(self._queues.items()))
+        channel_id, jobs = next(iter(channels.items()))
+        job = jobs.popleft()
+        if jobs:
+            channels.move_to_end(channel_id)
+        else:
+            del channels[channel_id]
+        if channels:
+            self._queues.move_to_end(guild_id)
+        else:
+            del self._queues[guild_id]
+        return job
+
+    async def _work(self):
+        while True:
+            await self._queued.acquire()
+            job, future, tag = self._next()
+            self._space.release()
+            if future.done():
+                # the caller gave up or the job was cancelled while queued
+                continue
+            task = self._loop.create_task(job())
+            self._running[task] = tag
+            try:
+                # unlike awaiting the task, waiting for it is not cancelled
+                # along with it
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                future.cancel()
+                raise
+            finally:
+                del self._running[task]
+            if future.done():
+                continue
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        for channels in self._queues.values():
+            for jobs in channels.values():
+                for _, future, _ in jobs:
+                    future.cancel()
+        self._queues.clear()
+        self._workers = []
+        self._loop = None
+
+
+_scheduler = None
+
+
+def get_ocr_scheduler():
+    """Return the OCR scheduler, creating it on first use.
+
+    ``DISCORD_BOT_OCR_CONCURRENCY`` sets how many OCR jobs run at once
+    (default: ``DISCORD_BOT_OCR_WORKERS``, or one per CPU) and
+    ``DISCORD_BOT_OCR_QUEUE_SIZE`` how many may wait (default: 64).
+    """
+    global _scheduler
+    if _scheduler is None:
+        workers = os.getenv("DISCORD_BOT_OCR_WORKERS", os.cpu_count() or 1)
+        concurrency = int(os.getenv("DISCORD_BOT_OCR_CONCURRENCY", workers))
+        capacity = int(os.getenv("DISCORD_BOT_OCR_QUEUE_SIZE", 64))
+        _scheduler = OCRScheduler(concurrency, capacity)
+    return _scheduler
+
+
+async def close_ocr_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.close()
+        _scheduler = None
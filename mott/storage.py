@@ -0,0 +1,340 @@
+"""
+Append-only TinyDB storage for the guild ledgers.
+
+TinyDB's ``JSONStorage`` rewrites the whole database file on every insert, so
+recording a payment costs more the longer an account's history is, and a
+crash half way through the rewrite leaves a corrupt file. :class:`WALStorage`
+keeps the database in memory and appends only the documents a write changed
+to a log next to the snapshot, syncing the log to disk in batches. Once the
+log is long enough it is compacted: the snapshot is replaced atomically by
+the current state and the log emptied. Snapshots are plain TinyDB JSON, so
+existing ``JSONStorage`` files are read as they are. TinyDB itself still reads
+and rewrites the whole database on every operation, which :class:`WALTinyDB`
+avoids by editing the storage's tables in place.
+
+:class:`CachingJSONStorage` keeps the plain JSON file format, rewriting it on
+every write, but serves reads from the last parsed or written state for as
+long as the file is unchanged on disk.
+"""
+
+import json
+import logging
+import os
+import time
+from collections.abc import MutableMapping
+
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage, Storage
+from tinydb.table import Table
+
+logger_discord = logging.getLogger("discord")
+
+
+def copy_tables(data):
+    """Copy a database down to its documents.
+
+    TinyDB edits the documents it reads in place, so a storage that keeps the
+    database in memory hands out copies to keep its own state intact.
+    """
+    return {
+        name: {doc_id: dict(doc) for doc_id, doc in table.items()}
+        for name, table in data.items()
+    }
+
+
+class WALStorage(Storage):
+    """TinyDB storage made of a JSON snapshot and a log of changes since.
+
+    Log records are JSON lines of the form ``{"table": name, "upsert":
+    {doc_id: doc}, "remove": [doc_id]}`` or ``{"table": name, "drop": true}``,
+    which can be replayed more than once without changing the result. The log
+    is flushed on every write and synced once ``sync_every`` records or
+    ``sync_interval`` seconds have built up, and compacted into the snapshot
+    after ``compact_every`` records.
+    """
+
+    def __init__(
+        self, path, sync_every=32, sync_interval=1.0, compact_every=10000, **kwargs
+    ):
+        super().__init__()
+        self.path = path
+        self.log_path = f"{path}.wal"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.kwargs = kwargs
+        self.records = 0
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._data = self._load_snapshot()
+        self._replay()
+        self._handle = open(self.log_path, "a", encoding="utf-8")
+        if self.records >= self.compact_every:
+            self.compact()
+
+    def _load_snapshot(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _replay(self):
+        if not os.path.isfile(self.log_path):
+            return
+        good = 0
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                # a record is only complete once its newline is written, as
+                # the next one would be appended to the same line otherwise
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                self.records += 1
+                good += len(line)
+        if good < os.path.getsize(self.log_path):
+            # a write torn by a crash, drop it so new records start on a
+            # fresh line
+            logger_discord.warning(
+                f"db log {self.log_path}: discarding a torn record after"
+                f" {self.records} records"
+            )
+            with open(self.log_path, "r+b") as f:
+                f.truncate(good)
+
+    def _apply(self, record):
+        name = record["table"]
+        if record.get("drop"):
+            self._data.pop(name, None)
+            return
+        table = self._data.setdefault(name, {})
+        table.update(record.get("upsert", {}))
+        for doc_id in record.get("remove", []):
+            table.pop(doc_id, None)
+
+    def read(self):
+        if not self._data:
+            return None
+        # the current state is kept to compare the next write with
+        return copy_tables(self._data)
+
+    def has_table(self, name):
+        return name in self._data
+
+    def table(self, name, create=False):
+        """The documents of a table by doc id, edited in place by
+        :class:`WALTable` and logged with :meth:`log`."""
+        if create:
+            return self._data.setdefault(name, {})
+        return self._data.get(name, {})
+
+    def write(self, data):
+        records = []
+        for name in self._data.keys() - data.keys():
+            records.append({"table": name, "drop": True})
+        for name, table in data.items():
+            old = self._data.get(name)
+            if old is None:
+                records.append({"table": name, "upsert": table})
+                continue
+            upsert = {
+                doc_id: doc
+                for doc_id, doc in table.items()
+                if doc_id not in old or old[doc_id] != doc
+            }
+            remove = [doc_id for doc_id in old if doc_id not in table]
+            if upsert or remove:
+                records.append({"table": name, "upsert": upsert, "remove": remove})
+        self._data = data
+        self.log(*records)
+
+    def log(self, *records):
+        """Append records of changes already made to the tables."""
+        if not records:
+            return
+        self._handle.write(
+            "".join(json.dumps(r, **self.kwargs) + "\n" for r in records)
+        )
+        self._handle.flush()
+        self.records += len(records)
+        self._unsynced += len(records)
+        if self.records >= self.compact_every:
+            self.compact()
+        elif (
+            self._unsynced >= self.sync_every
+            or time.monotonic() - self._synced_at >= self.sync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        """Make every logged write durable."""
+        if self._unsynced == 0:
+            return
+        os.fsync(self._handle.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def compact(self):
+        """Replace the snapshot with the current state and empty the log."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, **self.kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        # the log is only emptied once the snapshot holds everything in it
+        self._handle.truncate(0)
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        logger_discord.info(f"db log {self.log_path}: compacted {self.records} records")
+        self.records = 0
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if self._handle.closed:
+            return
+        if self.records:
+            self.compact()
+        self._handle.close()
+
+
+class TableEdit(MutableMapping):
+    """The documents of a table as TinyDB's updaters expect them, by int doc
+    id, noting which ones an update touched.
+
+    Updaters may edit the documents they read in place, so a copy of each is
+    kept when it is first read to tell whether it changed.
+    """
+
+    def __init__(self, documents, document_id_class=int):
+        self.documents = documents
+        self.document_id_class = document_id_class
+        self.read = {}
+        self.written = set()
+
+    def __getitem__(self, doc_id):
+        key = str(doc_id)
+        doc = self.documents[key]
+        if key not in self.read:
+            self.read[key] = dict(doc)
+        return doc
+
+    def __setitem__(self, doc_id, doc):
+        self.documents[str(doc_id)] = doc
+        self.written.add(str(doc_id))
+
+    def __delitem__(self, doc_id):
+        del self.documents[str(doc_id)]
+        self.written.add(str(doc_id))
+
+    def __iter__(self):
+        return map(self.document_id_class, self.documents)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def clear(self):
+        self.written.update(self.documents)
+        self.documents.clear()
+
+    def record(self, name):
+        """The log record of the changes, or None if there were none."""
+        upsert = {
+            key: self.documents[key]
+            for key in self.written | self.read.keys()
+            if key in self.documents
+            and (key in self.written or self.documents[key] != self.read[key])
+        }
+        remove = [key for key in self.written if key not in self.documents]
+        if not upsert and not remove:
+            return None
+        return {"table": name, "upsert": upsert, "remove": remove}
+
+
+class WALTable(Table):
+    """TinyDB table of a :class:`WALStorage` that reads the storage's own
+    documents and logs only the ones an operation changed, so an insert costs
+    the same however large the database is."""
+
+    def _read_table(self):
+        return self._storage.table(self.name)
+
+    def _update_table(self, updater):
+        # TinyDB creates a table on its first update, even an empty one
+        created = not self._storage.has_table(self.name)
+        edit = TableEdit(
+            self._storage.table(self.name, create=True), self.document_id_class
+        )
+        try:
+            updater(edit)
+        finally:
+            # log whatever was changed, even by an updater that failed part way
+            record = edit.record(self.name)
+            if record is None and created:
+                record = {"table": self.name, "upsert": {}}
+            if record is not None:
+                self._storage.log(record)
+            self.clear_cache()
+
+
+class WALTinyDB(TinyDB):
+    """TinyDB database kept in a :class:`WALStorage` at path."""
+
+    table_class = WALTable
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, storage=WALStorage, **kwargs)
+
+
+class CachingJSONStorage(JSONStorage):
+    """TinyDB ``JSONStorage`` that only parses the file when it has changed.
+
+    The file is identified by its inode, size and modification time in
+    nanoseconds. Writes go straight through to the file and update the
+    cached state, so only a change made by something else, such as a
+    restored backup, causes the file to be parsed again. ``generation`` counts
+    the times it was, so indexes built from the database can tell when they
+    are out of date.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.path = path
+        self._encoding = kwargs.get("encoding")
+        self.loads = 0
+        self.generation = 0
+        self._data = None
+        self._signature = None
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def refresh(self):
+        """Parse the file again if it changed, returning the generation."""
+        signature = self._stat()
+        if signature != self._signature:
+            if self._signature is not None and signature[0] != self._signature[0]:
+                # replaced rather than rewritten, follow the new file
+                self._handle.close()
+                self._handle = open(self.path, mode=self._mode, encoding=self._encoding)
+            self._data = super().read()
+            self._signature = signature
+            self.loads += 1
+            self.generation += 1
+        return self.generation
+
+    def read(self):
+        self.refresh()
+        if self._data is None:
+            return None
+        return copy_tables(self._data)
+
+    def write(self, data):
+        super().write(data)
+        self._data = data
+        self._signature = self._stat()
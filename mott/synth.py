@@ -0,0 +1,276 @@
+"""
+Synthetic mo.trader receipts for testing and benchmarking the OCR pipeline.
+
+Receipts are drawn with PIL after the layout of the in-game transfer screen:
+a grey panel over a dark, noisy cockpit with a title, a "Transaction
+Successful" line, the amount box and the YES/NO buttons, plus the HUD clutter
+that also holds aUEC figures (the sent notification and the current balance).
+Resolution, amount, font, JPEG quality and noise vary from receipt to
+receipt, and a corpus is reproducible from its seed.
+"""
+
+import io
+import random
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# encoded image, the amount it shows and how it was drawn
+Receipt = namedtuple("Receipt", ["image_bytes", "value", "size", "font", "quality"])
+
+# 16:9 and 16:10 screens from 720p to 4k
+RESOLUTIONS = (
+    (1280, 720),
+    (1440, 900),
+    (1664, 936),
+    (1920, 1080),
+    (1920, 1200),
+    (2560, 1440),
+    (3840, 2160),
+)
+
+# tried in order, those that are not installed are skipped
+FONTS = (
+    "default",
+    "DejaVuSans.ttf",
+    "DejaVuSansCondensed.ttf",
+    "LiberationSans-Regular.ttf",
+    "FreeSans.ttf",
+    "Arial.ttf",
+)
+
+# geometry of the 1664x936 reference screenshot, scaled to the others
+REFERENCE_WIDTH = 1664
+
+_fonts = {}
+
+
+def available_fonts():
+    """Return the names in :data:`FONTS` that can be loaded here."""
+    return [name for name in FONTS if _font(name, 12) is not None]
+
+
+def _font(name, size):
+    key = (name, size)
+    if key not in _fonts:
+        try:
+            if name == "default":
+                _fonts[key] = ImageFont.load_default(size=size)
+            else:
+                _fonts[key] = ImageFont.truetype(name, size)
+        except OSError:
+            _fonts[key] = None
+    return _fonts[key]
+
+
+def random_value(rng):
+    """An amount with the spread of real transfers, from tens to millions."""
+    value = int(10 ** rng.uniform(1, 7.5))
+    if rng.random() < 0.5:
+        # people mostly send round numbers
+        value = round(value, -max(0, len(str(value)) - 2))
+    return max(1, value)
+
+
+def _centred(draw, x, y, text, font, fill):
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    draw.text(
+        (x - (right - left) / 2, y - (bottom - top) / 2 - top),
+        text,
+        font=font,
+        fill=fill,
+    )
+
+
+def _background(rng, width, height):
+    """A dark blue-green cockpit, blurred so it has no sharp text-like edges."""
+    small = np.zeros((9, 16, 3))
+    small[:] = rng.uniform(5, 15), rng.uniform(10, 25), rng.uniform(15, 30)
+    small += np.random.default_rng(rng.getrandbits(32)).uniform(-5, 15, small.shape)
+    image = Image.fromarray(np.clip(small, 0, 255).astype(np.uint8))
+    image = image.resize((width, height), Image.BICUBIC)
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(1, 4)):
+        # out of focus scenery
+        x, y = rng.uniform(0, width), rng.uniform(height / 2, height)
+        w, h = rng.uniform(0.1, 0.5) * width, rng.uniform(0.1, 0.3) * height
+        colour = tuple(rng.randint(30, 90) for _ in range(3))
+        draw.polygon(
+            [(x, y), (x + w, y + rng.uniform(-h, h) / 4), (x + w, y + h), (x, y + h)],
+            fill=colour,
+        )
+    return image.filter(ImageFilter.GaussianBlur(width / 200))
+
+
+def _hud(draw, rng, width, height, s, font, value):
+    """Blue HUD elements, some of which hold other aUEC figures."""
+    blue = (110, 170, 230)
+    small = _font(font, max(8, round(11 * s)))
+    # the current balance, a different number next to the currency token
+    balance = rng.randint(1000, 99_999_999)
+    x, y = width * rng.uniform(0.6, 0.7), height * 0.93
+    draw.rectangle(
+        (x, y - 22 * s, x + 110 * s, y + 22 * s),
+        outline=blue,
+        width=max(1, round(2 * s)),
+    )
+    _centred(draw, x + 55 * s, y - 12 * s, "CURRENT BALANCE", small, blue)
+    _centred(draw, x + 55 * s, y + 6 * s, f"{balance}aUEC", small, (230, 240, 255))
+    for i in range(4):
+        bx = x - (i + 1) * 60 * s
+        draw.rectangle(
+            (bx, y - 20 * s, bx + 48 * s, y + 20 * s),
+            outline=blue,
+            width=max(1, round(2 * s)),
+        )
+        _centred(
+            draw,
+            bx + 24 * s,
+            y + 4 * s,
+            str(rng.choice((100, 95, 80, 64))),
+            small,
+            (230, 240, 255),
+        )
+    for i in range(rng.randint(3, 9)):
+        bx = width * 0.22 + i * 50 * s
+        draw.rounded_rectangle(
+            (bx, y - 16 * s, bx + 40 * s, y + 16 * s),
+            4 * s,
+            outline=blue,
+            width=max(1, round(2 * s)),
+        )
+    for label, key in (("Exit", "F1"), ("Map", "F2"), ("Comms", "F11")):
+        y = height * rng.uniform(0.6, 0.7)
+        draw.text((width * 0.93, y), f"{label} {key}", font=small, fill=blue)
+    if rng.random() < 0.7:
+        # the transfer notification over the title, with the amount unformatted
+        _centred(
+            draw,
+            width * 0.5,
+            height * 0.175,
+            f"You sent {value} aUEC",
+            small,
+            (220, 230, 240),
+        )
+
+
+def _panel(draw, rng, width, height, s, font, value):
+    cx = width * rng.uniform(0.46, 0.5)
+    top = height * rng.uniform(0.19, 0.21)
+    half = 196 * s
+    bottom = top + 532 * s
+    grey = rng.randint(115, 135)
+    panel = (grey, grey - 2, grey - 6)
+    draw.rounded_rectangle((cx - half, top, cx + half, bottom), 12 * s, fill=panel)
+
+    orange = (240, 170, 60)
+    _centred(draw, cx, top - 40 * s, "mo.TRADER", _font(font, round(40 * s)), orange)
+    # the coin, drawn as rings so it is not read as text
+    r = 80 * s
+    coin_y = top + 130 * s
+    for k in range(3):
+        draw.ellipse(
+            (
+                cx - r + 8 * k * s,
+                coin_y - r * 0.9 + 8 * k * s,
+                cx + r - 8 * k * s,
+                coin_y + r * 0.9 - 8 * k * s,
+            ),
+            outline=orange,
+            width=max(1, round(4 * s)),
+        )
+
+    white = tuple(rng.randint(225, 250) for _ in range(3))
+    _centred(
+        draw,
+        cx,
+        top + 284 * s,
+        "Transaction Successful",
+        _font(font, round(24 * s)),
+        white,
+    )
+    box = (cx - 165 * s, top + 330 * s, cx + 165 * s, top + 398 * s)
+    draw.rectangle(
+        box, fill=(grey - 12, grey - 12, grey - 14), outline=(grey + 10,) * 3
+    )
+    org = rng.choice(
+        (
+            "30k Weapons Division",
+            "Hurston Dynamics",
+            "Crusader Security",
+            "Shubin Interstellar",
+            "a friend",
+        )
+    )
+    _centred(
+        draw,
+        cx,
+        top + 349 * s,
+        f"{org} has received:",
+        _font(font, round(13 * s)),
+        (210, 210, 210),
+    )
+    _centred(
+        draw, cx, top + 375 * s, f"{value:,} aUEC", _font(font, round(25 * s)), white
+    )
+    _centred(
+        draw,
+        cx,
+        top + 450 * s,
+        "Make another transfer?",
+        _font(font, round(13 * s)),
+        (215, 215, 215),
+    )
+    for x0, label in ((cx - 176 * s, "YES"), (cx + 8 * s, "NO")):
+        draw.rectangle(
+            (x0, top + 476 * s, x0 + 168 * s, top + 520 * s), fill=(grey + 25,) * 3
+        )
+        _centred(
+            draw,
+            x0 + 84 * s,
+            top + 500 * s,
+            label,
+            _font(font, round(18 * s)),
+            (70, 70, 80),
+        )
+
+
+def render_receipt(
+    value, size=(1664, 936), font="default", quality=90, noise=4.0, seed=0
+):
+    """Draw a receipt for value and return it encoded as a JPEG."""
+    rng = random.Random(seed)
+    width, height = size
+    s = width / REFERENCE_WIDTH
+    image = _background(rng, width, height)
+    draw = ImageDraw.Draw(image)
+    _hud(draw, rng, width, height, s, font, value)
+    _panel(draw, rng, width, height, s, font, value)
+    if noise:
+        pixels = np.asarray(image, dtype=np.float32)
+        pixels = pixels + np.random.default_rng(seed).normal(0, noise, pixels.shape)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def generate(count, seed=0, resolutions=RESOLUTIONS, fonts=None):
+    """Yield count reproducible receipts with randomised content and encoding."""
+    rng = random.Random(seed)
+    fonts = fonts or available_fonts()
+    for _ in range(count):
+        value = random_value(rng)
+        size = rng.choice(resolutions)
+        font = rng.choice(fonts)
+        quality = rng.randint(55, 95)
+        image_bytes = render_receipt(
+            value,
+            size,
+            font,
+            quality,
+            noise=rng.uniform(0, 8),
+            seed=rng.getrandbits(32),
+        )
+        yield Receipt(image_bytes, value, size, font, quality)
@@ -4,16 +4,27 @@ from logging import StreamHandler
 logger = logging.getLogger("discord")
 logger.setLevel(logging.DEBUG)
 
+import asyncio
+import json
+import os
+import threading
+
 import pytest
 import tinydb
 import tinydb.storages
 import mott.accounts as acc
+from mott.storage import CachingJSONStorage, WALStorage, WALTinyDB
 
 
-@pytest.fixture
-def test_accounts():
-    db = tinydb.TinyDB(storage=tinydb.storages.MemoryStorage)
-    return acc.Accounts(db)
+@pytest.fixture(params=["tinydb", "sqlite"])
+def test_accounts(request):
+    if request.param == "sqlite":
+        accounts = acc.SQLiteAccounts(":memory:")
+    else:
+        db = tinydb.TinyDB(storage=tinydb.storages.MemoryStorage)
+        accounts = acc.Accounts(db)
+    yield accounts
+    accounts.close()
 
 
 msg_id, account_name, role_id = 0, "Chris Roberts", "CEO"
@@ -126,3 +137,379 @@ class TestAccounts:
         _ = test_accounts.create(account_name, role_id)
         account_names = test_accounts.account_names()
         assert account_name in account_names
+
+    def test_accounts_totals(self, test_accounts):
+        test_accounts.create(account_name, role_id)
+        test_accounts.pay_to(0, "BoneW", account_name, 1e7)
+        test_accounts.pay_to(1, "greyL", account_name, 1e6)
+        test_accounts.withdraw_from(2, "SalteMike", account_name, 1e3)
+        test_accounts.remove_transactions(account_name, 1)
+        for _ in range(2):
+            assert test_accounts.balance(account_name) == 1e7 - 1e3
+            assert test_accounts.summary(account_name) == ({"BoneW": 1e7}, 1e3)
+            test_accounts.rebuild_totals(account_name)
+        test_accounts.reset(account_name)
+        assert test_accounts.balance(account_name) == 0
+        assert test_accounts.summary(account_name) == ({}, 0)
+
+    def test_accounts_amount_limit(self, test_accounts):
+        test_accounts.create(account_name, role_id)
+        with pytest.raises(acc.AccountAmountError):
+            test_accounts.pay_to(0, "BoneW", account_name, 10**19)
+        with pytest.raises(acc.AccountAmountError):
+            test_accounts.withdraw_from(1, "SalteMike", account_name, 10**19)
+        test_accounts.pay_to(2, "BoneW", account_name, acc.MAX_AMOUNT)
+        assert test_accounts.balance(account_name) == acc.MAX_AMOUNT
+        assert len(test_accounts.all(account_name)) == 1
+
+    def test_accounts_int_totals(self, test_accounts):
+        test_accounts.create(account_name, role_id)
+        test_accounts.pay_to(0, "BoneW", account_name, 1000)
+        test_accounts.withdraw_from(1, "SalteMike", account_name, 100)
+        # as for a database from before totals were kept
+        test_accounts.rebuild_totals(account_name)
+        balance = test_accounts.balance(account_name)
+        assert balance == 900 and type(balance) is int
+        assert f"{balance}aUEC" == "900aUEC"
+        assert test_accounts.summary(account_name) == ({"BoneW": 1000}, 100)
+        values = [t["value"] for t in test_accounts.all(account_name)]
+        assert values == [1000, -100]
+        assert all(type(value) is int for value in values)
+
+    def test_accounts_stale_totals(self):
+        db = tinydb.TinyDB(storage=tinydb.storages.MemoryStorage)
+        accounts = acc.Accounts(db)
+        accounts.create(account_name, role_id)
+        accounts.pay_to(0, "BoneW", account_name, 1e7)
+        # a crash between writing a transaction and its totals
+        db.table(f"{account_name}_transactions").insert(
+            acc.new_transaction(1, "BoneW", 1e6, False)
+        )
+        accounts = acc.Accounts(db)
+        assert accounts.balance(account_name) == 1e7 + 1e6
+        assert accounts.summary(account_name) == ({"BoneW": 1e7 + 1e6}, 0)
+
+    def test_accounts_messages(self, test_accounts):
+        test_accounts.create(account_name, role_id)
+        assert test_accounts.pay_to(0, "BoneW", account_name, 1e7, deduplicate=True)
+        assert not test_accounts.pay_to(0, "BoneW", account_name, 1e7, deduplicate=True)
+        # further images of the same message
+        assert test_accounts.pay_to(0, "BoneW", account_name, 1e6)
+        test_accounts.pay_to(1, "greyL", account_name, 1e3)
+        assert test_accounts.has_message(account_name, 0)
+        assert not test_accounts.has_message(account_name, 2)
+        removed = test_accounts.remove_transactions(account_name, 0)
+        assert [t["value"] for t in removed] == [1e7, 1e6]
+        assert not test_accounts.has_message(account_name, 0)
+        assert test_accounts.balance(account_name) == 1e3
+        test_accounts.reset(account_name)
+        assert not test_accounts.has_message(account_name, 1)
+        with pytest.raises(acc.AccountDoesNotExistError):
+            test_accounts.has_message("Ben Lesnick", 0)
+
+    def test_accounts_messages_reload(self):
+        db = tinydb.TinyDB(storage=tinydb.storages.MemoryStorage)
+        accounts = acc.Accounts(db)
+        accounts.create(account_name, role_id)
+        accounts.pay_to(0, "BoneW", account_name, 1e7)
+        accounts = acc.Accounts(db)
+        assert not accounts.pay_to(0, "BoneW", account_name, 1e7, deduplicate=True)
+        assert len(accounts.remove_transactions(account_name, 0)) == 1
+
+    def test_accounts_owners(self, test_accounts):
+        test_accounts.create(account_name, role_id)
+        test_accounts.reset(account_name)
+        assert test_accounts.owning_role(account_name) == role_id
+        assert test_accounts.permitted(account_name, ["@CEO"])
+        assert not test_accounts.permitted(account_name, ["pleb"])
+        assert not test_accounts.permitted("Ben Lesnick", ["CEO"])
+        test_accounts.delete(account_name)
+        assert not test_accounts.permitted(account_name, ["CEO"])
+        with pytest.raises(acc.MottException):
+            test_accounts.owning_role(account_name)
+
+    def test_accounts_owners_reload(self):
+        db = tinydb.TinyDB(storage=tinydb.storages.MemoryStorage)
+        acc.Accounts(db).create(account_name, role_id)
+        accounts = acc.Accounts(db)
+        assert accounts.account_names() == [account_name]
+        assert accounts.permitted(account_name, ["CEO"])
+        with pytest.raises(acc.AccountAlreadyExistsError):
+            accounts.create(account_name, role_id)
+
+    def test_accounts_ids(self, test_accounts):
+        # the bot names accounts by channel id and records user ids
+        test_accounts.create(1234, "@5678")
+        test_accounts.pay_to(9, 42, 1234, 100, verified=True)
+        assert test_accounts.account_names() == [1234]
+        assert test_accounts.permitted(1234, [5678])
+        assert test_accounts.summary(1234) == ({42: 100}, 0)
+        last = test_accounts.last_transaction(1234)
+        assert last == test_accounts.all(1234)[0]
+        assert last["user_id"] == 42
+        assert last["ocr-verified"] is True
+        assert last.doc_id == 1
+
+
+class TestSQLiteAccounts:
+    def test_sqlite_indexes(self, tmp_path):
+        accounts = acc.SQLiteAccounts(str(tmp_path / "bank_db.sqlite"))
+        plans = {
+            "balance": "SELECT SUM(value) FROM transactions WHERE account = 1",
+            "remove": "SELECT id FROM transactions WHERE message_id = 1 AND account = 1",
+            "last": "SELECT id FROM transactions WHERE account = 1"
+            " ORDER BY timestamp DESC, id DESC LIMIT 1",
+        }
+        for name, query in plans.items():
+            plan = " ".join(
+                row[-1] for row in accounts.db.execute(f"EXPLAIN QUERY PLAN {query}")
+            )
+            assert "USING" in plan and "INDEX" in plan, name
+            assert "TEMP B-TREE" not in plan, name
+        accounts.create(account_name, role_id)
+        accounts.pay_to(msg_id, "BoneW", account_name, 1e7)
+        accounts.close()
+        accounts = acc.SQLiteAccounts(str(tmp_path / "bank_db.sqlite"))
+        assert accounts.balance(account_name) == 1e7
+        accounts.close()
+
+
+class TestAsyncAccounts:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("backend", ["wal", "sqlite"])
+    async def test_async_accounts(self, tmp_path, monkeypatch, backend):
+        monkeypatch.setenv("DISCORD_BOT_DB_DIR", str(tmp_path))
+        monkeypatch.setenv("DISCORD_BOT_DB_BACKEND", backend)
+        bank = acc.get_bank("Guild 1")
+        assert bank is acc.get_bank("Guild 1")
+        await bank.create(account_name, role_id)
+        # writes are made in order on the bank's own thread
+        await asyncio.gather(
+            *(bank.pay_to(i, "BoneW", account_name, 1e3) for i in range(10))
+        )
+        last = await bank.last_transaction(account_name)
+        assert last["message_id"] == 9
+        names = [thread.name for thread in threading.enumerate()]
+        assert any(name.startswith("bank-Guild 1") for name in names)
+        with pytest.raises(acc.AccountDoesNotExistError):
+            await bank.balance("Ben Lesnick")
+        acc.close_banks()
+        bank = acc.get_bank("Guild 1")
+        assert await bank.balance(account_name) == 1e4
+        acc.close_banks()
+
+    @pytest.mark.asyncio
+    async def test_async_accounts_batch(self, tmp_path):
+        path = str(tmp_path / "bank_db.json")
+        bank = acc.AsyncAccounts(
+            lambda: acc.Accounts(WALTinyDB(path)),
+            batch_window=0.05,
+            batch_size=4,
+        )
+        await bank.create(account_name, role_id)
+        created = bank._bank.db.storage.records
+        payments = [bank.pay_to(i, "BoneW", account_name, 1e3) for i in range(8)]
+        payments.append(bank.pay_to(0, "BoneW", account_name, 1e3, deduplicate=True))
+        payments.append(bank.pay_to(9, "BoneW", "Ben Lesnick", 1e3))
+        results = await asyncio.gather(*payments, return_exceptions=True)
+        assert results[:9] == [True] * 8 + [False]
+        assert isinstance(results[9], acc.AccountDoesNotExistError)
+        # two full batches and the rest after the window
+        assert bank.commits == 3
+        # each full batch is one record for the ledger and one for the totals,
+        # the last had nothing to write
+        assert bank._bank.db.storage.records == created + 2 * 2
+        await bank.pay_to(10, "greyL", account_name, 1e3)
+        # a read commits the payments waiting before it
+        assert await bank.balance(account_name) == 9e3
+        # closing writes payments still waiting for the window
+        waiting = asyncio.ensure_future(bank.pay_to(11, "greyL", account_name, 1e3))
+        await asyncio.sleep(0)
+        bank.close()
+        waiting.cancel()
+        accounts = acc.Accounts(WALTinyDB(path))
+        assert accounts.balance(account_name) == 10e3
+
+    @pytest.mark.asyncio
+    async def test_async_accounts_idle_sync(self, tmp_path):
+        path = str(tmp_path / "bank_db.json")
+        bank = acc.AsyncAccounts(
+            lambda: acc.Accounts(WALTinyDB(path, sync_every=1000, sync_interval=1000)),
+            sync_interval=0.05,
+        )
+        await bank.create(account_name, role_id)
+        await bank.pay_to(0, "BoneW", account_name, 1e3)
+        storage = bank._bank.db.storage
+        assert storage._unsynced > 0
+        # the last writes to a quiet bank are synced without waiting for more
+        await asyncio.sleep(0.2)
+        assert storage._unsynced == 0
+        bank.close()
+
+
+class TestBankManager:
+    @pytest.mark.asyncio
+    async def test_bank_manager(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DISCORD_BOT_DB_BACKEND", "wal")
+        manager = acc.BankManager(
+            lambda bank_id: acc.open_bank(str(tmp_path / f"{bank_id}_db")),
+            capacity=2,
+            batch_window=0.05,
+        )
+        for bank_id in range(3):
+            await manager.get(bank_id).create(account_name, role_id)
+            await manager.get(bank_id).pay_to(0, "BoneW", account_name, bank_id)
+        # the least recently used bank was closed to make room
+        assert (manager.hits, manager.misses, manager.evictions) == (3, 3, 1)
+        assert len(manager) == 2
+        assert manager.get(0) is manager.get(0)
+        assert await manager.get(0).balance(account_name) == 0
+        assert manager.evictions == 2
+
+        # a bank with payments waiting is not closed
+        waiting = asyncio.ensure_future(
+            manager.get(2).pay_to(1, "BoneW", account_name, 1e3)
+        )
+        await asyncio.sleep(0)
+        manager.get(1)
+        manager.get(3)
+        assert list(manager._open) == [2, 3]
+        assert await waiting
+        manager.get(4)
+        assert list(manager._open) == [3, 4]
+
+        manager.idle_timeout = 0
+        manager.get(2)
+        assert list(manager._open) == [2]
+        assert manager.evictions == 7
+        assert await manager.get(1).balance(account_name) == 1
+        assert await manager.get(2).balance(account_name) == 2 + 1e3
+        manager.close()
+
+
+class TestWALStorage:
+    def test_wal_replay(self, tmp_path):
+        path = str(tmp_path / "bank_db.json")
+        accounts = acc.Accounts(WALTinyDB(path))
+        accounts.create(account_name, role_id)
+        accounts.pay_to(0, "BoneW", account_name, 1e7)
+        accounts.pay_to(1, "greyL", account_name, 1e6)
+        accounts.remove_transactions(account_name, 1)
+        records = accounts.db.storage.records
+        # a crash, nothing is compacted and the last write is torn
+        accounts.db.storage._handle.write('{"table": "acc')
+        accounts.db.storage._handle.flush()
+        storage = WALStorage(path)
+        assert storage.records == records
+        accounts = acc.Accounts(tinydb.TinyDB(storage=lambda: storage))
+        assert accounts.balance(account_name) == 1e7
+        accounts.pay_to(2, "greyL", account_name, 1e3)
+        accounts.db.close()
+        accounts = acc.Accounts(WALTinyDB(path))
+        assert accounts.balance(account_name) == 1e7 + 1e3
+        accounts.delete(account_name)
+        accounts.db.close()
+        accounts = acc.Accounts(WALTinyDB(path))
+        assert accounts.account_names() == []
+
+    def test_wal_torn_newline(self, tmp_path):
+        path = str(tmp_path / "bank_db.json")
+        db = WALTinyDB(path)
+        for i in range(3):
+            db.insert({"i": i})
+        db.storage._handle.truncate(os.path.getsize(f"{path}.wal") - 1)
+        db.storage._handle.close()
+        # the last record parses without its newline but is still torn
+        db = WALTinyDB(path)
+        assert len(db) == 2
+        for i in range(3, 6):
+            db.insert({"i": i})
+        db.storage._handle.close()
+        assert [doc["i"] for doc in WALTinyDB(path)] == [0, 1, 3, 4, 5]
+
+    def test_wal_table(self, tmp_path, mocker):
+        path = str(tmp_path / "bank_db.json")
+        accounts = acc.Accounts(WALTinyDB(path))
+        accounts.create(account_name, role_id)
+        for i in range(100):
+            accounts.pay_to(i, "BoneW", account_name, 1000)
+        storage = accounts.db.storage
+        read = mocker.spy(storage, "read")
+        log = mocker.spy(storage, "log")
+        accounts.pay_to(100, "greyL", account_name, 1000, deduplicate=True)
+        accounts.remove_transactions(account_name, 0)
+        # only the documents changed are logged, without reading the database
+        assert read.call_count == 0
+        records = [call.args[0] for call in log.call_args_list]
+        assert [len(r["upsert"]) + len(r["remove"]) for r in records] == [1] * 4
+        totals = accounts.totals(account_name)
+        accounts.db.close()
+        accounts = acc.Accounts(WALTinyDB(path))
+        assert accounts.totals(account_name) == totals
+        assert accounts.balance(account_name) == 100000
+
+    def test_wal_compact(self, tmp_path):
+        path = str(tmp_path / "bank_db.json")
+        # an existing JSONStorage database is read as the snapshot
+        accounts = acc.Accounts(tinydb.TinyDB(path))
+        accounts.create(account_name, role_id)
+        accounts.db.close()
+        db = WALTinyDB(path, compact_every=4)
+        accounts = acc.Accounts(db)
+        for i in range(12):
+            # a transaction and its account totals
+            accounts.pay_to(i, "BoneW", account_name, 1e3)
+            assert db.storage.records == 2 * ((i + 1) % 2)
+        with open(path) as f:
+            snapshot = json.load(f)
+        assert len(snapshot[f"{account_name}_transactions"]) == 12
+        accounts.pay_to(12, "BoneW", account_name, 1e3)
+        db.close()
+        assert WALStorage(path).records == 0
+        accounts = acc.Accounts(tinydb.TinyDB(path))
+        assert accounts.balance(account_name) == 13e3
+
+
+class TestCachingJSONStorage:
+    def test_caching_json_storage(self, tmp_path):
+        path = str(tmp_path / "bank_db.json")
+        db = tinydb.TinyDB(path, storage=CachingJSONStorage)
+        accounts = acc.Accounts(db)
+        accounts.create(account_name, role_id)
+        accounts.pay_to(0, "BoneW", account_name, 1e7)
+        accounts.summary(account_name)
+        accounts.all(account_name)
+        # parsed once when opened, every write updates the cached state
+        assert db.storage.loads == 1
+
+        # changed by something else, the indexes are rebuilt
+        accounts.pay_to(11, "greyL", account_name, 100)
+        other = acc.Accounts(tinydb.TinyDB(path))
+        other.remove_transactions(account_name, 11)
+        other.db.close()
+        assert accounts.balance(account_name) == 1e7
+        assert db.storage.loads == 2
+        assert [t["message_id"] for t in accounts.all(account_name)] == [0]
+        assert not accounts.has_message(account_name, 11)
+        with pytest.raises(acc.AccountError):
+            accounts.remove_transactions(account_name, 11)
+        other = tinydb.TinyDB(path)
+        other.table(f"{account_name}_transactions").insert(
+            acc.new_transaction(12, "greyL", 100, False)
+        )
+        other.close()
+        accounts.pay_to(13, "greyL", account_name, 100)
+        assert [t["message_id"] for t in accounts.all(account_name)] == [0, 12, 13]
+        assert accounts.balance(account_name) == 1e7 + 200
+
+        # replaced by a restored backup
+        backup = str(tmp_path / "backup_db.json")
+        restored = acc.Accounts(tinydb.TinyDB(backup))
+        restored.create("Ben Lesnick", role_id)
+        restored.db.close()
+        os.replace(backup, path)
+        assert accounts.account_names() == ["Ben Lesnick"]
+        assert db.storage.loads == 4
+        accounts.pay_to(1, "BoneW", "Ben Lesnick", 1e3)
+        db.close()
+        assert acc.Accounts(tinydb.TinyDB(path)).balance("Ben Lesnick") == 1e3
@@ -11,6 +11,8 @@ import pytest
 import pytest_asyncio
 
 import mott.bot
+from mott.classify import NotAReceiptError
+from mott.extract import Amount, OCRaUECNotFoundError
 from discord.ext.commands import CheckFailure, UserInputError, CommandError
 
 
@@ -63,7 +65,7 @@ class TestBot:
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
 
@@ -90,7 +92,7 @@ class TestBot:
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
 
@@ -117,7 +119,7 @@ class TestBot:
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
         mocked_account.last_transaction.return_value = {
@@ -152,7 +154,7 @@ class TestBot:
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
 
@@ -185,7 +187,7 @@ time,author,value,ocr-verified
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_account.all.return_value = [
             {"timestamp": 0, "user_id": 0, "value": 18082308, "ocr-verified": True},
             {"timestamp": 0, "user_id": 1, "value": 578308, "ocr-verified": False},
@@ -210,7 +212,7 @@ time,author,value,ocr-verified
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
 
@@ -231,7 +233,7 @@ time,author,value,ocr-verified
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
 
@@ -252,7 +254,7 @@ time,author,value,ocr-verified
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_account.balance.return_value = 1
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
@@ -277,7 +279,7 @@ time,author,value,ocr-verified
         future.set_result(test_response)
         mocked_ctx.send.return_value = future
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_account.summary.return_value = {
             0: 18082308,
             1: 578308,
@@ -298,7 +300,7 @@ time,author,value,ocr-verified
         )
         mocked_ctx.bot = mocked_bot
         mocked_ctx.message = mocked_message
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_account.permitted.return_value = True
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
@@ -321,18 +323,19 @@ time,author,value,ocr-verified
         future.set_result(test_response)
         mocked_message.channel.send.return_value = future
         mocked_message.attachments = [
-            mocker.Mock(),
+            mocker.Mock(width=1280, height=720),
         ]
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = False
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
 
         mocked_OCR = mocker.patch("mott.bot.OCR")
 
         ocr_reader_future = asyncio.Future()
-        ocr_reader_future.set_result(auec_amount)
-        mocked_OCR.image_to_auec.return_value = ocr_reader_future
+        ocr_reader_future.set_result(Amount(auec_amount, 0.93))
+        mocked_OCR.image_to_amount.return_value = ocr_reader_future
 
         ocr_future = asyncio.Future()
         ocr_future.set_result(mocked_OCR)
@@ -350,9 +353,212 @@ time,author,value,ocr-verified
             mocked_message.channel.id,
             auec_amount,
             verified=True,
+            deduplicate=True,
         )
 
         mocked_message.channel.send.assert_called_with(test_response)
+        await mott.bot.close_ocr_scheduler()
+
+    @pytest.mark.asyncio
+    async def test_read_attachment(self, mocker):
+        attachment = mocker.Mock(width=3840, height=2160)
+        attachment.proxy_url = "https://media.discordapp.net/attachments/1/2/a.png?ex=1"
+        scaled = "https://media.discordapp.net/attachments/1/2/a.png?ex=1&width=1600&height=900"
+
+        readers = [mocker.Mock(), mocker.Mock()]
+        readers[0].image_to_amount = mocker.AsyncMock(
+            side_effect=OCRaUECNotFoundError("")
+        )
+        readers[1].image_to_amount = mocker.AsyncMock(return_value=Amount(5, 0.9))
+        mocked_create = mocker.patch(
+            "mott.bot.OCR.create", mocker.AsyncMock(side_effect=readers)
+        )
+
+        # the downscaled copy cannot be read, so the original is
+        assert await mott.bot.read_attachment(attachment) == Amount(5, 0.9)
+        assert [c.args[0] for c in mocked_create.call_args_list] == [
+            scaled,
+            attachment.proxy_url,
+        ]
+
+        mocked_create.reset_mock(side_effect=True)
+        mocked_create.return_value = readers[1]
+        attachment.width, attachment.height = 1280, 720
+        assert await mott.bot.read_attachment(attachment) == Amount(5, 0.9)
+        mocked_create.assert_called_once_with(attachment.proxy_url)
+
+    @pytest.mark.asyncio
+    async def test_on_message_attachments(self, mocker, mocked_message):
+        mocked_message.attachments = [mocker.Mock() for _ in range(3)]
+        mocked_message.channel.send = mocker.AsyncMock()
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = False
+        mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
+        mocked_bank.return_value = mocked_account
+        mocked_attachment_is_image = mocker.patch("mott.bot.attachment_is_image")
+        mocked_attachment_is_image.return_value = True
+
+        reading = []
+        amounts = [Amount(100, 0.9), None, Amount(300, 0.2)]
+
+        async def read_attachment(attachment):
+            i = mocked_message.attachments.index(attachment)
+            reading.append(i)
+            # the first image finishes last
+            await asyncio.sleep(0.01 * (3 - i))
+            if amounts[i] is None:
+                raise OCRaUECNotFoundError("")
+            return amounts[i]
+
+        mocker.patch("mott.bot.read_attachment", read_attachment)
+        await mott.bot.on_message(mocked_message)
+
+        # all three were in flight at once, and are recorded in order
+        assert len(reading) == 3
+        assert [c.args[3] for c in mocked_account.pay_to.call_args_list] == [100, 300]
+        assert [
+            c.kwargs["deduplicate"] for c in mocked_account.pay_to.call_args_list
+        ] == [True, False]
+        mocked_message.channel.send.assert_called_once()
+        response = mocked_message.channel.send.call_args.args[0]
+        name = mocked_message.author.display_name
+        channel = mocked_message.channel.name
+        assert response.splitlines()[:3] == [
+            f"{name} paid {channel} 100 aUEC.",
+            "Sorry, I couldn't read the aUEC from image 2.",
+            f"{name} paid {channel} 300 aUEC."
+            " I'm not sure I read that right, please check it.",
+        ]
+        await mott.bot.close_ocr_scheduler()
+
+    @pytest.mark.asyncio
+    async def test_on_message_unexpected_error(self, mocker, mocked_message):
+        mocked_message.attachments = [mocker.Mock() for _ in range(2)]
+        mocked_message.channel.send = mocker.AsyncMock()
+        mocked_message.add_reaction = mocker.AsyncMock()
+        mocked_message.remove_reaction = mocker.AsyncMock()
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = False
+        mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
+        mocked_bank.return_value = mocked_account
+        mocked_read = mocker.patch("mott.bot.read_attachment")
+        # e.g. a worker process that died
+        mocked_read.side_effect = [Amount(100, 0.9), RuntimeError("broken pool")]
+        mocked_attachment_is_image = mocker.patch("mott.bot.attachment_is_image")
+        mocked_attachment_is_image.return_value = True
+        # a full queue, so the message is marked as waiting
+        scheduler = mott.bot.get_ocr_scheduler()
+        mocker.patch.object(type(scheduler), "__len__", lambda _: scheduler.capacity)
+
+        await mott.bot.on_message(mocked_message)
+
+        mocked_account.pay_to.assert_called_once()
+        response = mocked_message.channel.send.call_args.args[0]
+        assert (
+            response.splitlines()[1] == "Sorry, I couldn't read the aUEC from image 2."
+        )
+        mocked_message.remove_reaction.assert_called_once()
+        await mott.bot.close_ocr_scheduler()
+
+    @pytest.mark.asyncio
+    async def test_on_raw_message_delete(self, mocker, mocked_message):
+        mocked_message.attachments = [mocker.Mock() for _ in range(2)]
+        mocked_message.channel.send = mocker.AsyncMock()
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = False
+        mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
+        mocked_bank.return_value = mocked_account
+        mocked_attachment_is_image = mocker.patch("mott.bot.attachment_is_image")
+        mocked_attachment_is_image.return_value = True
+
+        started = asyncio.Event()
+
+        async def read_attachment(attachment):
+            started.set()
+            await asyncio.sleep(10)
+            return Amount(100, 0.9)
+
+        mocker.patch("mott.bot.read_attachment", read_attachment)
+        reading = asyncio.ensure_future(mott.bot.on_message(mocked_message))
+        await started.wait()
+        payload = mocker.Mock(message_id=mocked_message.id)
+        await mott.bot.on_raw_message_delete(payload)
+        await asyncio.wait_for(reading, 1)
+
+        mocked_account.pay_to.assert_not_called()
+        mocked_message.channel.send.assert_not_called()
+        await mott.bot.close_ocr_scheduler()
+
+    @pytest.mark.asyncio
+    async def test_on_message_deleted_after_read(self, mocker, mocked_message):
+        mocked_message.attachments = [mocker.Mock() for _ in range(2)]
+        mocked_message.channel.send = mocker.AsyncMock()
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = False
+        mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
+        mocked_bank.return_value = mocked_account
+        mocked_read = mocker.patch("mott.bot.read_attachment")
+        mocked_read.return_value = Amount(100, 0.9)
+        mocked_attachment_is_image = mocker.patch("mott.bot.attachment_is_image")
+        mocked_attachment_is_image.return_value = True
+
+        async def pay_to(*args, **kwargs):
+            # deleted while the first image was being recorded
+            payload = mocker.Mock(message_id=mocked_message.id)
+            await mott.bot.on_raw_message_delete(payload)
+            return True
+
+        mocked_account.pay_to.side_effect = pay_to
+        await mott.bot.on_message(mocked_message)
+
+        mocked_account.pay_to.assert_called_once()
+        mocked_message.channel.send.assert_not_called()
+        await mott.bot.close_ocr_scheduler()
+
+    @pytest.mark.asyncio
+    async def test_on_message_not_receipt(self, mocker, mocked_message):
+        mocked_message.attachments = [
+            mocker.Mock(),
+        ]
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = False
+        mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
+        mocked_bank.return_value = mocked_account
+        mocked_read = mocker.patch("mott.bot.read_attachment")
+        mocked_read.side_effect = NotAReceiptError(0.1)
+        mocked_attachment_is_image = mocker.patch("mott.bot.attachment_is_image")
+        mocked_attachment_is_image.return_value = True
+
+        await mott.bot.on_message(mocked_message)
+
+        mocked_account.pay_to.assert_not_called()
+        mocked_message.channel.send.assert_not_called()
+        await mott.bot.close_ocr_scheduler()
+
+    @pytest.mark.asyncio
+    async def test_on_message_replayed(self, mocker, mocked_message):
+        mocked_message.attachments = [mocker.Mock(), mocker.Mock()]
+        mocked_message.channel.send = mocker.AsyncMock()
+        mocked_account = mocker.AsyncMock()
+        mocked_account.has_message.return_value = True
+        mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
+        mocked_bank.return_value = mocked_account
+        mocked_read = mocker.patch("mott.bot.read_attachment")
+        mocked_attachment_is_image = mocker.patch("mott.bot.attachment_is_image")
+        mocked_attachment_is_image.return_value = True
+
+        # already recorded before the images are read
+        await mott.bot.on_message(mocked_message)
+        mocked_read.assert_not_called()
+
+        # recorded by another delivery of the message while they were read
+        mocked_account.has_message.return_value = False
+        mocked_account.pay_to.return_value = False
+        mocked_read.return_value = Amount(100, 0.9)
+        await mott.bot.on_message(mocked_message)
+        mocked_account.pay_to.assert_called_once()
+        mocked_message.channel.send.assert_not_called()
+        await mott.bot.close_ocr_scheduler()
 
     @pytest.mark.asyncio
     async def test_on_reaction_add(self, mocker, mocked_message):
@@ -375,7 +581,7 @@ time,author,value,ocr-verified
             mocker.Mock(),
         ]
 
-        mocked_account = mocker.Mock()
+        mocked_account = mocker.AsyncMock()
         mocked_bank = mocker.patch("mott.bot.accounts.get_bank")
         mocked_bank.return_value = mocked_account
         mocked_account.remove_transactions.return_value = [
@@ -0,0 +1,80 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import pytest
+from mott.cache import CachedFailure, OCRCache
+from mott.extract import Amount
+
+
+class TestCache:
+    def test_cache_key(self):
+        assert OCRCache.key(b"receipt") == OCRCache.key(b"receipt")
+        assert OCRCache.key(b"receipt") != OCRCache.key(b"meme")
+        assert OCRCache.key(b"receipt", "1") != OCRCache.key(b"receipt", "2")
+
+    def test_cache_lru(self):
+        cache = OCRCache(capacity=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_cache_failure(self):
+        cache = OCRCache()
+        failure = CachedFailure("OCRaUECNotFoundError", "OCR: aUEC not found")
+        cache.put("a", failure)
+        assert cache.get("a") == failure
+
+    def test_cache_persistent(self, tmp_path):
+        path = tmp_path / "ocr_cache.db"
+        cache = OCRCache(capacity=1, path=path)
+        failure = CachedFailure("OCRNumberNotFoundError", "OCR: number not found")
+        cache.put("a", Amount(820000, 0.93))
+        cache.put("b", failure)
+        cache.close()
+
+        cache = OCRCache(capacity=1, path=path)
+        assert cache.get("a") == Amount(820000, 0.93)
+        assert cache.get("b") == failure
+        assert cache.get("c") is None
+        cache.close()
+
+    @pytest.mark.asyncio
+    async def test_cache_persistent_thread(self, tmp_path, mocker):
+        cache = OCRCache(capacity=1, path=tmp_path / "ocr_cache.db")
+        load = mocker.spy(cache, "_load")
+        await cache.store("a", Amount(820000, 0.93))
+        await cache.store("b", Amount(5, 0.5))
+        # the disk tier is only used off the event loop
+        assert cache._executor is not None
+        assert await cache.fetch("a") == Amount(820000, 0.93)
+        assert await cache.fetch("a") == Amount(820000, 0.93)
+        assert await cache.fetch("c") is None
+        assert load.call_count == 2
+        assert (cache.hits, cache.misses) == (2, 1)
+        cache.close()
+        cache = OCRCache(capacity=1, path=tmp_path / "ocr_cache.db")
+        assert cache.get("b") == Amount(5, 0.5)
+        cache.close()
+
+    def test_cache_persistent_eviction(self, tmp_path):
+        cache = OCRCache(capacity=0, path=tmp_path / "ocr_cache.db", disk_capacity=10)
+        for i in range(11):
+            cache.put(str(i), Amount(i, 1.0))
+        assert cache.get("0") is None
+        assert cache.get("10") == Amount(10, 1.0)
+        # results read back are kept over ones that were not
+        assert cache.get("1") == Amount(1, 1.0)
+        for i in range(11, 20):
+            cache.put(str(i), Amount(i, 1.0))
+        assert cache.get("1") == Amount(1, 1.0)
+        assert cache.get("2") is None
+        cache.close()
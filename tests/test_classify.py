@@ -0,0 +1,71 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import io
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from mott.classify import NotAReceiptError, check_receipt, receipt_score
+from mott.ocr import OCRConfig, read_amount
+from mott.synth import generate
+
+
+def encode(image, format="JPEG"):
+    out = io.BytesIO()
+    image.save(out, format)
+    return out.getvalue()
+
+
+class TestClassify:
+    def test_receipts(self):
+        with open("tests/data/bigmotradertest.jpeg", "rb") as f:
+            assert receipt_score(f.read()) > 0.8
+        for receipt in generate(5, seed=2):
+            assert receipt_score(receipt.image_bytes) > 0.6
+
+    @pytest.mark.parametrize(
+        "box",
+        [
+            # the panel with a margin, nearly square
+            (560, 200, 1030, 690),
+            # the amount and the buttons below it
+            (575, 450, 1005, 670),
+            # only the amount line
+            (610, 510, 970, 600),
+        ],
+    )
+    def test_cropped_receipts(self, box):
+        image = Image.open("tests/data/bigmotradertest.jpeg").crop(box)
+        image_bytes = encode(image)
+        assert check_receipt(image_bytes, 0.4) > 0.6
+        assert read_amount(image_bytes, OCRConfig()).value == 820000
+
+    @pytest.mark.parametrize(
+        "image",
+        [
+            Image.new("RGB", (1920, 1080), "white"),
+            Image.new("RGB", (1920, 1080), (120, 120, 120)),
+            Image.new("RGB", (1080, 1920), (20, 20, 20)),
+            Image.fromarray(
+                np.random.default_rng(0).integers(0, 255, (540, 960, 3), np.uint8)
+            ),
+        ],
+    )
+    def test_not_receipts(self, image):
+        image_bytes = encode(image)
+        assert receipt_score(image_bytes) < 0.2
+        assert receipt_score(encode(image, "PNG")) < 0.2
+        with pytest.raises(NotAReceiptError):
+            check_receipt(image_bytes, 0.4)
+
+    def test_error_pickles(self):
+        # the error is raised in an OCR worker and sent back to the bot
+        error = pickle.loads(pickle.dumps(NotAReceiptError(0.1)))
+        assert isinstance(error, NotAReceiptError)
+        assert error.message == NotAReceiptError(0.1).message
@@ -0,0 +1,81 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+import mott.download as dl
+
+
+@pytest_asyncio.fixture
+async def test_server():
+    async def image(request):
+        return web.Response(body=b"x" * 200_000)
+
+    async def stream(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(4):
+            await response.write(b"x" * 100_000)
+        return response
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.Response(body=b"x")
+
+    app = web.Application()
+    app.router.add_get("/image", image)
+    app.router.add_get("/stream", stream)
+    app.router.add_get("/slow", slow)
+    app.router.add_get("/missing", missing)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    yield f"http://127.0.0.1:{port}"
+    await dl.close_session()
+    await runner.cleanup()
+
+
+class TestDownload:
+    @pytest.mark.asyncio
+    async def test_download(self, test_server):
+        body = await dl.download(f"{test_server}/image")
+        assert len(body) == 200_000
+        session = await dl.open_session()
+        body = await dl.download(f"{test_server}/stream")
+        assert len(body) == 400_000
+        assert await dl.open_session() is session
+
+    @pytest.mark.asyncio
+    async def test_download_limits(self, test_server):
+        with pytest.raises(dl.DownloadError):
+            await dl.download(f"{test_server}/image", max_bytes=100_000)
+        with pytest.raises(dl.DownloadError):
+            await dl.download(f"{test_server}/stream", max_bytes=250_000)
+        with pytest.raises(dl.DownloadError):
+            await dl.download(f"{test_server}/slow", timeout=0.1)
+        with pytest.raises(dl.DownloadError):
+            await dl.download(f"{test_server}/missing")
+
+    def test_scaled_url(self):
+        url = "https://media.discordapp.net/attachments/1/2/a.png?ex=65&hm=ab"
+        assert dl.scaled_url(url, 3840, 2160, 900) == (
+            "https://media.discordapp.net/attachments/1/2/a.png"
+            "?ex=65&hm=ab&width=1600&height=900"
+        )
+        assert dl.scaled_url(url, 3440, 1440, 720).endswith("width=1720&height=720")
+        assert dl.scaled_url(url, 1280, 720, 900) is None
+        assert dl.scaled_url(url, None, None, 900) is None
+        assert dl.scaled_url(url, 3840, 2160, 0) is None
+        assert dl.scaled_url("not a url", 3840, 2160, 900) is None
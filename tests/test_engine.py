@@ -0,0 +1,56 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import importlib.util
+
+import pytest
+from PIL import Image
+
+import mott.engine as engine
+from mott.exceptions import MottException
+
+
+class TestEngine:
+    def test_available_engine(self):
+        assert engine.available_engine("pytesseract") == "pytesseract"
+        assert engine.available_engine("gocr") == engine.DEFAULT_ENGINE
+        if importlib.util.find_spec("tesserocr") is None:
+            assert engine.available_engine("tesserocr") == engine.DEFAULT_ENGINE
+        else:
+            assert engine.available_engine("tesserocr") == "tesserocr"
+
+    def test_init_engine(self):
+        engine.init_engine("pytesseract")
+        assert isinstance(engine.get_engine(), engine.PytesseractEngine)
+        first = engine.get_engine()
+        assert engine.get_engine() is first
+
+    def test_parse_tsv(self):
+        tsv = (
+            "1\t1\t0\t0\t0\t0\t0\t0\t392\t41\t-1\t\n"
+            "5\t1\t1\t1\t1\t1\t115\t11\t94\t22\t93.290794\t820,000\n"
+            "5\t1\t1\t1\t1\t2\t216\t10\t58\t20\t80.488937\taUEC\n"
+        )
+        data = engine.parse_tsv(tsv)
+        assert data["text"] == ["", "820,000", "aUEC"]
+        assert data["conf"] == [-1, 93.290794, 80.488937]
+        assert data["line_num"] == [0, 1, 1]
+        assert data["left"] == [0, 115, 216]
+
+    def test_pytesseract_timeout(self):
+        image = Image.open("tests/data/bigmotradertest.jpeg")
+        with pytest.raises(MottException):
+            engine.PytesseractEngine().image_to_data(image, timeout=0.01)
+
+    @pytest.mark.skipif(
+        importlib.util.find_spec("tesserocr") is None, reason="needs tesserocr"
+    )
+    def test_tesserocr_path(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("TESSDATA_PREFIX", str(tmp_path))
+        assert engine.tessdata_path() == f"{tmp_path}/"
+        # no language data there, so it fails with the path it tried
+        with pytest.raises(MottException, match=str(tmp_path)):
+            engine.TesserocrEngine()
@@ -0,0 +1,75 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import pytest
+from mott.extract import (
+    Amount,
+    OCRaUECNotFoundError,
+    OCRNumberNotFoundError,
+    amount_from_data,
+    amount_from_text,
+    parse_number,
+)
+
+
+def tesseract_data(lines):
+    """Build image_to_data style output from lines of (text, conf) words."""
+    data = {k: [] for k in ("block_num", "par_num", "line_num", "text", "conf")}
+    for line_num, words in enumerate(lines, start=1):
+        for text, conf in [("", -1)] + words:
+            data["block_num"].append(1)
+            data["par_num"].append(1)
+            data["line_num"].append(line_num)
+            data["text"].append(text)
+            data["conf"].append(conf)
+    return data
+
+
+class TestExtract:
+    def test_parse_number(self):
+        numbers = {
+            "820,000": 820000,
+            "820.000": 820000,
+            "820 000": 820000,
+            "1'820'000": 1820000,
+            "1 820 000": 1820000,
+            "41625978": 41625978,
+            "2 820,000": 820000,
+        }
+        for k, v in numbers.items():
+            assert parse_number(k) == v
+        with pytest.raises(OCRNumberNotFoundError):
+            parse_number("received:")
+
+    def test_amount_from_text(self):
+        assert amount_from_text("has received:\n820,000 aUEC\n") == 820000
+        assert amount_from_text("820,000 aUEG") == 820000
+        with pytest.raises(OCRaUECNotFoundError):
+            amount_from_text("41625978aUEC")
+
+    def test_amount_from_data(self):
+        data = tesseract_data(
+            [
+                [("Transaction", 96), ("Successful", 96)],
+                [("820,000", 93), ("aUEC", 80)],
+                [("Make", 77), ("another", 92), ("transfer?", 83)],
+            ]
+        )
+        assert amount_from_data(data) == Amount(820000, 0.93)
+
+        data = tesseract_data(
+            [
+                [("You", 60), ("sent", 60), ("820000", 40), ("aVEC", 50)],
+                [("820", 91), ("000", 88), ("aUEC", 90)],
+            ]
+        )
+        assert amount_from_data(data) == Amount(820000, 0.88)
+
+    def test_amount_from_data_errors(self):
+        with pytest.raises(OCRaUECNotFoundError):
+            amount_from_data(tesseract_data([[("41625978aUEC", 90)]]))
+        with pytest.raises(OCRNumberNotFoundError):
+            amount_from_data(tesseract_data([[("received:", 90), ("aUEC", 90)]]))
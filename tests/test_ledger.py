@@ -0,0 +1,86 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import tracemalloc
+
+import pytest
+from tinydb.table import Document
+
+import mott.accounts as acc
+from mott.ledger import Ledger
+
+
+def documents(count):
+    users = [123456789012345678 + i for i in range(20)]
+    return [
+        Document(
+            {
+                "message_id": 1000000000000000000 + i,
+                "timestamp": 1700000000 + i,
+                "user_id": users[i % len(users)],
+                "value": -(i % 1000) if i % 7 == 0 else i % 1000,
+                "ocr-verified": i % 2 == 0,
+            },
+            doc_id=i + 1,
+        )
+        for i in range(count)
+    ]
+
+
+class TestLedger:
+    def test_ledger_rows(self):
+        docs = documents(10)
+        ledger = Ledger.from_documents(docs)
+        assert len(ledger) == 10
+        assert list(ledger) == docs
+        assert ledger[-1] == docs[-1]
+        assert ledger[3].doc_id == 4
+        assert ledger[3]["user_id"] == docs[3]["user_id"]
+        assert ledger[2]["ocr-verified"] is True
+        with pytest.raises(IndexError):
+            ledger[10]
+        with pytest.raises(KeyError):
+            ledger[0]["account"]
+
+    def test_ledger_totals(self):
+        docs = documents(500)
+        ledger = Ledger.from_documents(docs)
+        totals = acc.tally(dict(acc.ZERO_TOTALS), docs)
+        assert ledger.totals() == totals
+        assert type(ledger.totals()["balance"]) is int
+        assert type(ledger[1]["value"]) is int
+        assert Ledger().totals() == acc.ZERO_TOTALS
+        # a float amount keeps the values as given
+        docs[1]["value"] = 2.5
+        ledger = Ledger.from_documents(docs)
+        assert ledger[1]["value"] == 2.5
+        assert ledger[2]["value"] == docs[2]["value"]
+        assert ledger.totals() == acc.tally(dict(acc.ZERO_TOTALS), docs)
+
+    def test_ledger_large_values(self):
+        docs = documents(10)
+        # sums past 64 bits are made with Python ints
+        docs[1]["value"] = 2**62
+        docs[3]["value"] = 2**62
+        ledger = Ledger.from_documents(docs)
+        assert ledger.totals() == acc.tally(dict(acc.ZERO_TOTALS), docs)
+        # and so are values that do not fit in 64 bits at all
+        docs[5]["value"] = 10**19
+        ledger = Ledger.from_documents(docs)
+        assert ledger[5]["value"] == 10**19
+        assert ledger[6]["value"] == docs[6]["value"]
+        assert ledger.totals() == acc.tally(dict(acc.ZERO_TOTALS), docs)
+
+    def test_ledger_memory(self):
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        docs = documents(20000)
+        docs_size = tracemalloc.get_traced_memory()[0] - start
+        start = tracemalloc.get_traced_memory()[0]
+        ledger = Ledger.from_documents(docs)
+        ledger_size = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        assert ledger_size * 5 < docs_size
@@ -4,18 +4,43 @@ from logging import StreamHandler
 logger = logging.getLogger("discord")
 logger.setLevel(logging.DEBUG)
 
+import asyncio
+import io
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import mott.ocr
+from mott.cache import CachedFailure, OCRCache
+from mott.classify import NotAReceiptError
 from mott.exceptions import MottException
+from mott.extract import Amount
 from mott.ocr import (
     OCR,
+    OCRConfig,
+    OCRImageTooLargeError,
+    OCRImageUnreadableError,
     OCRInvalidURLError,
+    OCRTimeoutError,
     OCRaUECNotFoundError,
     OCRNumberNotFoundError,
+    decode,
+    get_ocr_pool,
+    locate_amount,
+    preprocess,
+    shutdown_ocr_pool,
     uri_validator,
 )
+import numpy as np
+from PIL import Image, ImageOps
 import pytest
 import pytest_asyncio
 
 
+def slow_read(image_bytes, config=None):
+    time.sleep(30)
+
+
 @pytest_asyncio.fixture
 async def test_ocr():
     return await OCR.create("tests/data/bigmotradertest.jpeg")
@@ -78,3 +103,174 @@ class TestOCR:
         }
         for k, v in contents_and_value.items():
             assert test_ocr.auec_value(k) == v
+
+    def test_ocr_pool(self, monkeypatch):
+        shutdown_ocr_pool()
+        monkeypatch.setenv("DISCORD_BOT_OCR_WORKERS", "2")
+        pool = get_ocr_pool()
+        assert pool._max_workers == 2
+        assert get_ocr_pool() is pool
+        shutdown_ocr_pool()
+        assert get_ocr_pool() is not pool
+        shutdown_ocr_pool()
+
+    @pytest.mark.asyncio
+    async def test_ocr_cache(self, mocker, test_ocr):
+        cache = OCRCache()
+        mocker.patch("mott.ocr._ocr_cache", cache)
+        mocked_pool = mocker.patch("mott.ocr.get_ocr_pool")
+        key = cache.key(test_ocr.image_bytes, mott.ocr.cache_version(test_ocr.config))
+
+        cache.put(key, Amount(820000, 0.93))
+        assert await test_ocr.image_to_auec() == 820000
+        assert await test_ocr.image_to_amount() == Amount(820000, 0.93)
+
+        cache.put(key, CachedFailure("OCRaUECNotFoundError", "OCR: no aUEC"))
+        with pytest.raises(OCRaUECNotFoundError):
+            await test_ocr.image_to_auec()
+        mocked_pool.assert_not_called()
+
+        # results read with other settings are not reused
+        assert cache.key(test_ocr.image_bytes) != key
+        assert mott.ocr.cache_version(OCRConfig(binarise=True)) != (
+            mott.ocr.cache_version(OCRConfig())
+        )
+
+    @pytest.mark.asyncio
+    async def test_ocr_skips_non_receipts(self, mocker):
+        mocker.patch("mott.ocr._ocr_cache", OCRCache())
+        mocker.patch("mott.ocr.ocr_counts", Counter())
+        image = io.BytesIO()
+        Image.new("RGB", (1920, 1080), "white").save(image, "JPEG")
+        test_ocr = OCR()
+        test_ocr.uri = "white.jpeg"
+        test_ocr.image_bytes = image.getvalue()
+        test_ocr.config = OCRConfig()
+        with pytest.raises(NotAReceiptError):
+            await test_ocr.image_to_amount()
+        # the rejection is cached like any other failure
+        with pytest.raises(NotAReceiptError):
+            await test_ocr.image_to_amount()
+        assert mott.ocr.ocr_counts == {"skipped": 1}
+
+        test_ocr.config = OCRConfig(min_receipt_score=0)
+        mott.ocr._ocr_cache = OCRCache()
+        with pytest.raises(OCRaUECNotFoundError):
+            await test_ocr.image_to_amount()
+        assert mott.ocr.ocr_counts == {"skipped": 1, "processed": 1}
+        shutdown_ocr_pool()
+
+    @pytest.mark.asyncio
+    async def test_ocr_timeout(self, mocker, monkeypatch, test_ocr):
+        mocker.patch("mott.ocr._ocr_cache", OCRCache())
+        monkeypatch.setenv("DISCORD_BOT_OCR_TIMEOUT", "0.1")
+        mocker.patch("mott.ocr.get_ocr_pool", return_value=ThreadPoolExecutor(1))
+        mocker.patch("mott.ocr.read_tiered", lambda *args: time.sleep(1))
+        with pytest.raises(OCRTimeoutError):
+            await test_ocr.image_to_amount()
+
+    @pytest.mark.asyncio
+    async def test_ocr_stops_abandoned_reads(self, mocker, monkeypatch, test_ocr):
+        mocker.patch("mott.ocr._ocr_cache", OCRCache())
+        mocker.patch("mott.ocr.read_tiered", slow_read)
+        monkeypatch.setenv("DISCORD_BOT_OCR_WORKERS", "1")
+        monkeypatch.setenv("DISCORD_BOT_OCR_TIMEOUT", "1")
+        shutdown_ocr_pool()
+        pool = get_ocr_pool()
+        start = time.monotonic()
+        with pytest.raises(OCRTimeoutError):
+            await test_ocr.image_to_amount()
+        assert time.monotonic() - start < 10
+        assert get_ocr_pool() is not pool
+
+        # as are reads whose message was deleted
+        task = asyncio.create_task(test_ocr.image_to_amount())
+        await asyncio.sleep(0.5)
+        processes = list(get_ocr_pool()._processes.values())
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for process in processes:
+            process.join(5)
+            assert not process.is_alive()
+        shutdown_ocr_pool()
+
+    def test_read_tiered(self, mocker):
+        with open("tests/data/bigmotradertest.jpeg", "rb") as f:
+            image_bytes = f.read()
+        amount, tier = mott.ocr.read_tiered(image_bytes)
+        assert (amount.value, tier) == (820000, "fast")
+        amount, tier = mott.ocr.read_tiered(image_bytes, OCRConfig(tiered=False))
+        assert (amount.value, tier) == (820000, "full")
+
+        # an unsure fast read is read again in full
+        mocker.patch("mott.ocr.read_fast", return_value=Amount(82000, 0.3))
+        amount, tier = mott.ocr.read_tiered(image_bytes)
+        assert (amount.value, tier) == (820000, "full")
+        # but kept if it is all there is
+        mocker.patch("mott.ocr.read_full", side_effect=OCRaUECNotFoundError(""))
+        assert mott.ocr.read_tiered(image_bytes) == (Amount(82000, 0.3), "fast")
+
+    def test_locate_amount(self):
+        image = Image.open("tests/data/bigmotradertest.jpeg")
+        boxes = locate_amount(image)
+        left, upper, right, lower = boxes[0]
+        # the "820,000 aUEC" line of the receipt panel
+        assert left < 700 and right > 880
+        assert upper < 554 and lower > 573
+        assert lower - upper < 60
+
+        assert locate_amount(Image.new("RGB", (1920, 1080))) == []
+
+    def test_decode(self):
+        with open("tests/data/bigmotradertest.jpeg", "rb") as f:
+            image_bytes = f.read()
+        image, pixels = decode(image_bytes)
+        assert pixels.shape == (936, 1664)
+        assert pixels.dtype == np.uint8
+        image, pixels = decode(image_bytes, max_width=1000)
+        assert pixels.shape == (562, 1000)
+        assert image.size == (1664, 936)
+        # decoded at half scale, the smallest that is still wide enough
+        image, pixels = decode(image_bytes, max_width=800)
+        assert pixels.shape == (450, 800)
+        assert image.size == (832, 468)
+
+    def test_decode_max_pixels(self):
+        with open("tests/data/bigmotradertest.jpeg", "rb") as f:
+            image_bytes = f.read()
+        image, pixels = decode(image_bytes, max_pixels=500_000)
+        assert image.size == (832, 468)
+        assert pixels.shape == (468, 832)
+
+        png = io.BytesIO()
+        Image.open(io.BytesIO(image_bytes)).save(png, "PNG")
+        with pytest.raises(OCRImageTooLargeError):
+            decode(png.getvalue(), max_pixels=500_000)
+        with pytest.raises(OCRImageTooLargeError):
+            mott.ocr.read_tiered(png.getvalue(), OCRConfig(max_pixels=500_000))
+        image, pixels = decode(png.getvalue(), max_width=800, max_pixels=2_000_000)
+        assert pixels.shape == (450, 800)
+
+    def test_decode_unreadable(self):
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"/>'
+        with pytest.raises(OCRImageUnreadableError):
+            decode(svg)
+        with pytest.raises(OCRImageUnreadableError):
+            mott.ocr.read_tiered(svg)
+        with open("tests/data/bigmotradertest.jpeg", "rb") as f:
+            truncated = f.read()[:2000]
+        with pytest.raises(OCRImageUnreadableError):
+            mott.ocr.read_tiered(truncated)
+
+    def test_preprocess(self):
+        image = Image.open("tests/data/bigmotradertest.jpeg").convert("L")
+        for cutoff in [(0, 95), (0, 50)]:
+            expected = ImageOps.autocontrast(ImageOps.invert(image), cutoff=cutoff)
+            pixels = np.array(image)
+            out = preprocess(pixels, cutoff, out=pixels)
+            assert out is pixels
+            assert np.array_equal(pixels, np.asarray(expected))
+
+        pixels = preprocess(np.array(image), (0, 95), binarise=True)
+        assert set(np.unique(pixels)) <= {0, 255}
@@ -0,0 +1,95 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import asyncio
+
+import pytest
+from mott.scheduler import OCRScheduler
+
+
+def recording_job(order, name, gate=None):
+    async def job():
+        if gate is not None:
+            await gate.wait()
+        order.append(name)
+        return name
+
+    return job
+
+
+class TestScheduler:
+    @pytest.mark.asyncio
+    async def test_scheduler_result(self):
+        scheduler = OCRScheduler(concurrency=2, capacity=4)
+
+        async def fail():
+            raise ValueError("unreadable")
+
+        assert await scheduler.run(0, 0, recording_job([], "a")) == "a"
+        with pytest.raises(ValueError):
+            await scheduler.run(0, 0, fail)
+        await scheduler.close()
+
+    @pytest.mark.asyncio
+    async def test_scheduler_fair(self):
+        scheduler = OCRScheduler(concurrency=1, capacity=16)
+        order = []
+        gate = asyncio.Event()
+        futures = [await scheduler.submit("busy", 0, recording_job(order, "b0", gate))]
+        # let the only worker pick up the first job and block on the gate
+        await asyncio.sleep(0)
+        for i in range(1, 4):
+            futures.append(
+                await scheduler.submit("busy", i % 2, recording_job(order, f"b{i}"))
+            )
+        futures.append(await scheduler.submit("quiet", 0, recording_job(order, "q0")))
+        gate.set()
+        await asyncio.gather(*futures)
+        # the quiet guild goes next rather than after the busy guild's backlog
+        assert order[:2] == ["b0", "b1"]
+        assert order[2] == "q0"
+        await scheduler.close()
+
+    @pytest.mark.asyncio
+    async def test_scheduler_backpressure(self):
+        scheduler = OCRScheduler(concurrency=1, capacity=1)
+        gate = asyncio.Event()
+        first = await scheduler.submit(0, 0, recording_job([], "a", gate))
+        await asyncio.sleep(0)
+        second = await scheduler.submit(0, 0, recording_job([], "b"))
+        assert scheduler.full()
+        third = asyncio.ensure_future(scheduler.submit(0, 0, recording_job([], "c")))
+        await asyncio.sleep(0)
+        assert not third.done()
+        gate.set()
+        assert await first == "a"
+        assert await second == "b"
+        assert await (await third) == "c"
+        await scheduler.close()
+
+    @pytest.mark.asyncio
+    async def test_scheduler_cancel(self):
+        scheduler = OCRScheduler(concurrency=1, capacity=4)
+        order = []
+        gate = asyncio.Event()
+        running = await scheduler.submit(0, 0, recording_job(order, "a", gate), "m1")
+        await asyncio.sleep(0)
+        queued = await scheduler.submit(0, 0, recording_job(order, "b"), "m1")
+        other = await scheduler.submit(0, 0, recording_job(order, "c"), "m2")
+
+        assert not scheduler.cancelled("m1")
+        assert scheduler.cancel("m1") == 2
+        assert scheduler.cancelled("m1")
+        # the running job's slot is free for the next one straight away
+        assert await other == "c"
+        assert running.cancelled() and queued.cancelled()
+        assert order == ["c"]
+
+        # jobs submitted after their tag was cancelled are never run
+        late = await scheduler.submit(0, 0, recording_job(order, "d"), "m1")
+        assert late.cancelled()
+        assert scheduler.cancel("m3") == 0
+        await scheduler.close()
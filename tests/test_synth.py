@@ -0,0 +1,40 @@
+import logging
+from logging import StreamHandler
+
+logger = logging.getLogger("discord")
+logger.setLevel(logging.DEBUG)
+
+import io
+
+import pytest
+from PIL import Image
+
+from mott.ocr import OCRConfig, locate_amount, read_amount
+from mott.synth import RESOLUTIONS, available_fonts, generate, render_receipt
+
+
+class TestSynth:
+    def test_generate(self):
+        receipts = list(generate(5, seed=7))
+        assert receipts == list(generate(5, seed=7))
+        assert receipts != list(generate(5, seed=8))
+        for receipt in receipts:
+            image = Image.open(io.BytesIO(receipt.image_bytes))
+            assert image.format == "JPEG"
+            assert image.size == receipt.size
+            assert receipt.size in RESOLUTIONS
+            assert receipt.font in available_fonts()
+            assert receipt.value > 0
+
+    def test_locate_amount(self):
+        image = Image.open(io.BytesIO(render_receipt(820000, seed=1)))
+        boxes = locate_amount(image)
+        # the amount box of the 1664x936 layout
+        assert any(upper < 575 and lower > 575 for _, upper, _, lower in boxes)
+
+    @pytest.mark.parametrize(
+        "config", [OCRConfig(), OCRConfig(roi=False, tiered=False)]
+    )
+    def test_read_amount(self, config):
+        for receipt in generate(4, seed=0):
+            assert read_amount(receipt.image_bytes, config).value == receipt.value